@@ -1,4 +1,18 @@
-from restub.stub import Service
+import sys
+
 
 __version__ = '1.12'
 __all__ = ['Service']
+
+
+if sys.version_info < (3, 7):
+    from restub.stub import Service
+else:
+    def __getattr__(name):
+        # The Service is imported on first use to keep "import restub" light
+        if name == 'Service':
+            from restub.stub import Service
+            return Service
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name)
+        )
@@ -0,0 +1,6 @@
+import sys
+
+from restub.cli import main
+
+
+sys.exit(main())
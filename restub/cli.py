@@ -0,0 +1,209 @@
+"""
+The command line interface runs the Service as a standalone server. Routes
+are loaded from a JSON file with a list of routes, each route is a list of
+values (method, path, data, headers, status) or an object with the same
+keys, or from a cache directory recorded in the proxy mode.
+
+Several worker processes can share one port. The startup time is printed when
+the server is ready, and the summary of metrics when it receives SIGTERM or
+SIGINT. With the profile option every worker also prints its slowest requests.
+
+Examples:
+    restub routes.json
+    restub routes.json --port 7777 --engine threading --workers 4
+    restub routes.json --unix /tmp/restub.sock
+    restub routes.json --crt restub.crt --key restub.key --delay 0.5
+    restub --proxy http://example.com --cache fixtures --trace
+    restub routes.json --profile 10 --profile-threshold 0.05
+"""
+
+
+import argparse
+import json
+import os
+import signal
+import sys
+import traceback
+from threading import Event
+from time import monotonic
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='restub', description='RESTub - REST Service Mocking'
+    )
+    parser.add_argument(
+        'routes', nargs='?',
+        help='JSON file with routes or directory of recorded responses'
+    )
+    parser.add_argument('-p', '--port', type=int, default=8081)
+    parser.add_argument(
+        '-u', '--unix', help='path of the Unix socket used instead of the port'
+    )
+    parser.add_argument(
+        '-e', '--engine', default='sync',
+        choices=['sync', 'threading', 'http2']
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='number of processes sharing the port'
+    )
+    parser.add_argument('--crt', help='file path to ssl certificate')
+    parser.add_argument('--key', help='file path to ssl private key')
+    parser.add_argument(
+        '-d', '--delay', type=float, default=0,
+        help='delay per response in seconds'
+    )
+    parser.add_argument('-t', '--trace', action='store_true')
+    parser.add_argument('--proxy', help='upstream for requests without route')
+    parser.add_argument('--cache', help='directory to record the responses')
+    parser.add_argument(
+        '--profile', type=int, default=0, metavar='N',
+        help='print N slowest requests with their phases on exit'
+    )
+    parser.add_argument(
+        '--profile-threshold', type=float, metavar='SECONDS',
+        help='sample stacks of requests running longer than the threshold'
+    )
+
+    args = parser.parse_args(argv)
+    if not args.routes and not args.proxy:
+        parser.error('routes or proxy should be defined')
+    if args.workers < 1:
+        parser.error('workers should be positive')
+    if args.workers > 1 and args.unix:
+        parser.error('several workers cannot share the Unix socket')
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        parser.error('several workers are not supported on this platform')
+    return args
+
+
+def load_routes(path):
+    """ Loads routes from a JSON file or a directory of recorded responses
+    :param path: (str) - path to the file or the directory
+    :return: (list) routes
+    """
+    from restub.proxy import Cache
+    from restub.route import parse_routes
+
+    if os.path.isdir(path):
+        return Cache(path).routes()
+
+    with open(path, 'rb') as f:
+        items = json.loads(f.read().decode())
+    if not isinstance(items, list):
+        raise TypeError('Routes should be list')
+    return parse_routes(items)
+
+
+def serve(args, started, reuse_port=False):
+    """ Runs the Service until SIGTERM or SIGINT
+    :return: (Metrics) metrics of the processed requests
+    """
+    from restub.stub import Service
+
+    stopped = Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopped.set())
+
+    srv = Service(
+        routes=load_routes(args.routes) if args.routes else None,
+        port=args.port,
+        unix=args.unix,
+        trace=args.trace,
+        delay=args.delay,
+        secure=bool(args.crt or args.key),
+        crt=args.crt or '',
+        key=args.key or '',
+        proxy=args.proxy,
+        cache=args.cache,
+        engine=args.engine,
+        reuse_port=reuse_port,
+        profile=args.profile,
+        profile_threshold=args.profile_threshold,
+    )
+    srv.start()
+    print('restub[%d] is running at %s, started in %.1f ms' % (
+        os.getpid(), srv.host, (monotonic() - started) * 1000
+    ), flush=True)
+
+    stopped.wait()
+    srv.stop()
+    if srv.profiler:
+        print('restub[%d] %s' % (os.getpid(), srv.profiler.dump()), flush=True)
+    return srv.metrics
+
+
+def fork(args, started):
+    """ Runs the workers sharing one port and merges their metrics """
+    from restub.metrics import Metrics
+
+    workers = {}
+    stopped = Event()
+
+    def terminate(*args):
+        stopped.set()
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    # Handlers are set before forking, so the early signal is not lost
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    for _ in range(args.workers):
+        if stopped.is_set():
+            break
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Until the worker sets its handlers, the signal terminates it
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.close(rfd)
+            workers.clear()
+            code = 1
+            try:
+                metrics = serve(args, started, reuse_port=True)
+                os.write(wfd, json.dumps(metrics.as_dict()).encode())
+                code = 0
+            except BaseException:
+                # The exit skips the handling of the exception, so print it
+                traceback.print_exc()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+        os.close(wfd)
+        workers[pid] = rfd
+
+    if stopped.is_set():
+        # The signal could come before the last worker was registered
+        terminate()
+
+    metrics, code = Metrics(), 0
+    for pid, rfd in workers.items():
+        with os.fdopen(rfd, 'rb') as f:
+            data = f.read()
+        _, status = os.waitpid(pid, 0)
+        if data:
+            metrics.merge(json.loads(data.decode()))
+        if status:
+            code = 1
+    return metrics, code
+
+
+def main(argv=None):
+    started = monotonic()
+    args = parse_args(argv)
+    if args.workers > 1:
+        metrics, code = fork(args, started)
+    else:
+        metrics, code = serve(args, started), 0
+    print(metrics.summary(), flush=True)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""
+HPACK is the compression of HTTP/2 header fields (RFC 7541). Each HTTP/2
+connection has a Decoder of the request headers and an Encoder of the
+response headers, both keep their dynamic table for the whole connection.
+
+The Encoder does not use Huffman coding, but the header fields which are
+repeated in the responses are added to the dynamic table, so the following
+responses refer to them by index.
+
+Examples:
+    encoder, decoder = Encoder(), Decoder()
+    block = encoder.encode([(':status', '200'), ('content-type', 'text/html')])
+    headers = decoder.decode(block)
+"""
+
+
+from collections import deque
+
+
+# Header fields which are not added to the dynamic table of the Encoder
+NOT_INDEXED = {'content-length', 'date', 'etag', 'last-modified', 'set-cookie'}
+
+DEFAULT_TABLE_SIZE = 4096
+
+# The overhead of every entry of the dynamic table in octets
+ENTRY_OVERHEAD = 32
+
+STATIC_TABLE = (
+    (':authority', ''),
+    (':method', 'GET'),
+    (':method', 'POST'),
+    (':path', '/'),
+    (':path', '/index.html'),
+    (':scheme', 'http'),
+    (':scheme', 'https'),
+    (':status', '200'),
+    (':status', '204'),
+    (':status', '206'),
+    (':status', '304'),
+    (':status', '400'),
+    (':status', '404'),
+    (':status', '500'),
+    ('accept-charset', ''),
+    ('accept-encoding', 'gzip, deflate'),
+    ('accept-language', ''),
+    ('accept-ranges', ''),
+    ('accept', ''),
+    ('access-control-allow-origin', ''),
+    ('age', ''),
+    ('allow', ''),
+    ('authorization', ''),
+    ('cache-control', ''),
+    ('content-disposition', ''),
+    ('content-encoding', ''),
+    ('content-language', ''),
+    ('content-length', ''),
+    ('content-location', ''),
+    ('content-range', ''),
+    ('content-type', ''),
+    ('cookie', ''),
+    ('date', ''),
+    ('etag', ''),
+    ('expect', ''),
+    ('expires', ''),
+    ('from', ''),
+    ('host', ''),
+    ('if-match', ''),
+    ('if-modified-since', ''),
+    ('if-none-match', ''),
+    ('if-range', ''),
+    ('if-unmodified-since', ''),
+    ('last-modified', ''),
+    ('link', ''),
+    ('location', ''),
+    ('max-forwards', ''),
+    ('proxy-authenticate', ''),
+    ('proxy-authorization', ''),
+    ('range', ''),
+    ('referer', ''),
+    ('refresh', ''),
+    ('retry-after', ''),
+    ('server', ''),
+    ('set-cookie', ''),
+    ('strict-transport-security', ''),
+    ('transfer-encoding', ''),
+    ('user-agent', ''),
+    ('vary', ''),
+    ('via', ''),
+    ('www-authenticate', ''),
+)
+
+HUFFMAN_CODES = (
+    0x1ff8, 0x7fffd8, 0xfffffe2, 0xfffffe3, 0xfffffe4, 0xfffffe5,
+    0xfffffe6, 0xfffffe7, 0xfffffe8, 0xffffea, 0x3ffffffc, 0xfffffe9,
+    0xfffffea, 0x3ffffffd, 0xfffffeb, 0xfffffec, 0xfffffed, 0xfffffee,
+    0xfffffef, 0xffffff0, 0xffffff1, 0xffffff2, 0x3ffffffe, 0xffffff3,
+    0xffffff4, 0xffffff5, 0xffffff6, 0xffffff7, 0xffffff8, 0xffffff9,
+    0xffffffa, 0xffffffb, 0x14, 0x3f8, 0x3f9, 0xffa,
+    0x1ff9, 0x15, 0xf8, 0x7fa, 0x3fa, 0x3fb,
+    0xf9, 0x7fb, 0xfa, 0x16, 0x17, 0x18,
+    0x0, 0x1, 0x2, 0x19, 0x1a, 0x1b,
+    0x1c, 0x1d, 0x1e, 0x1f, 0x5c, 0xfb,
+    0x7ffc, 0x20, 0xffb, 0x3fc, 0x1ffa, 0x21,
+    0x5d, 0x5e, 0x5f, 0x60, 0x61, 0x62,
+    0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+    0x69, 0x6a, 0x6b, 0x6c, 0x6d, 0x6e,
+    0x6f, 0x70, 0x71, 0x72, 0xfc, 0x73,
+    0xfd, 0x1ffb, 0x7fff0, 0x1ffc, 0x3ffc, 0x22,
+    0x7ffd, 0x3, 0x23, 0x4, 0x24, 0x5,
+    0x25, 0x26, 0x27, 0x6, 0x74, 0x75,
+    0x28, 0x29, 0x2a, 0x7, 0x2b, 0x76,
+    0x2c, 0x8, 0x9, 0x2d, 0x77, 0x78,
+    0x79, 0x7a, 0x7b, 0x7ffe, 0x7fc, 0x3ffd,
+    0x1ffd, 0xffffffc, 0xfffe6, 0x3fffd2, 0xfffe7, 0xfffe8,
+    0x3fffd3, 0x3fffd4, 0x3fffd5, 0x7fffd9, 0x3fffd6, 0x7fffda,
+    0x7fffdb, 0x7fffdc, 0x7fffdd, 0x7fffde, 0xffffeb, 0x7fffdf,
+    0xffffec, 0xffffed, 0x3fffd7, 0x7fffe0, 0xffffee, 0x7fffe1,
+    0x7fffe2, 0x7fffe3, 0x7fffe4, 0x1fffdc, 0x3fffd8, 0x7fffe5,
+    0x3fffd9, 0x7fffe6, 0x7fffe7, 0xffffef, 0x3fffda, 0x1fffdd,
+    0xfffe9, 0x3fffdb, 0x3fffdc, 0x7fffe8, 0x7fffe9, 0x1fffde,
+    0x7fffea, 0x3fffdd, 0x3fffde, 0xfffff0, 0x1fffdf, 0x3fffdf,
+    0x7fffeb, 0x7fffec, 0x1fffe0, 0x1fffe1, 0x3fffe0, 0x1fffe2,
+    0x7fffed, 0x3fffe1, 0x7fffee, 0x7fffef, 0xfffea, 0x3fffe2,
+    0x3fffe3, 0x3fffe4, 0x7ffff0, 0x3fffe5, 0x3fffe6, 0x7ffff1,
+    0x3ffffe0, 0x3ffffe1, 0xfffeb, 0x7fff1, 0x3fffe7, 0x7ffff2,
+    0x3fffe8, 0x1ffffec, 0x3ffffe2, 0x3ffffe3, 0x3ffffe4, 0x7ffffde,
+    0x7ffffdf, 0x3ffffe5, 0xfffff1, 0x1ffffed, 0x7fff2, 0x1fffe3,
+    0x3ffffe6, 0x7ffffe0, 0x7ffffe1, 0x3ffffe7, 0x7ffffe2, 0xfffff2,
+    0x1fffe4, 0x1fffe5, 0x3ffffe8, 0x3ffffe9, 0xffffffd, 0x7ffffe3,
+    0x7ffffe4, 0x7ffffe5, 0xfffec, 0xfffff3, 0xfffed, 0x1fffe6,
+    0x3fffe9, 0x1fffe7, 0x1fffe8, 0x7ffff3, 0x3fffea, 0x3fffeb,
+    0x1ffffee, 0x1ffffef, 0xfffff4, 0xfffff5, 0x3ffffea, 0x7ffff4,
+    0x3ffffeb, 0x7ffffe6, 0x3ffffec, 0x3ffffed, 0x7ffffe7, 0x7ffffe8,
+    0x7ffffe9, 0x7ffffea, 0x7ffffeb, 0xffffffe, 0x7ffffec, 0x7ffffed,
+    0x7ffffee, 0x7ffffef, 0x7fffff0, 0x3ffffee,
+)
+
+HUFFMAN_LENGTHS = (
+    13, 23, 28, 28, 28, 28, 28, 28, 28, 24, 30, 28, 28, 30, 28, 28,
+    28, 28, 28, 28, 28, 28, 30, 28, 28, 28, 28, 28, 28, 28, 28, 28,
+    6, 10, 10, 12, 13, 6, 8, 11, 10, 10, 8, 11, 8, 6, 6, 6,
+    5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 7, 8, 15, 6, 12, 10,
+    13, 6, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7,
+    7, 7, 7, 7, 7, 7, 7, 7, 8, 7, 8, 13, 19, 13, 14, 6,
+    15, 5, 6, 5, 6, 5, 6, 6, 6, 5, 7, 7, 6, 6, 6, 5,
+    6, 7, 6, 5, 5, 6, 7, 7, 7, 7, 7, 15, 11, 14, 13, 28,
+    20, 22, 20, 20, 22, 22, 22, 23, 22, 23, 23, 23, 23, 23, 24, 23,
+    24, 24, 22, 23, 24, 23, 23, 23, 23, 21, 22, 23, 22, 23, 23, 24,
+    22, 21, 20, 22, 22, 23, 23, 21, 23, 22, 22, 24, 21, 22, 23, 23,
+    21, 21, 22, 21, 23, 22, 23, 23, 20, 22, 22, 22, 23, 22, 22, 23,
+    26, 26, 20, 19, 22, 23, 22, 25, 26, 26, 26, 27, 27, 26, 24, 25,
+    19, 21, 26, 27, 27, 26, 27, 24, 21, 21, 26, 26, 28, 27, 27, 27,
+    20, 24, 20, 21, 22, 21, 21, 23, 22, 22, 25, 25, 24, 24, 26, 23,
+    26, 27, 26, 26, 27, 27, 27, 27, 27, 28, 27, 27, 27, 27, 27, 26,
+)
+
+# Indexes of the static fields and names, the first one for the repeated
+STATIC_INDEX = {
+    field: index
+    for index, field in reversed(list(enumerate(STATIC_TABLE, 1)))
+}
+STATIC_NAMES = {
+    field[0]: index
+    for index, field in reversed(list(enumerate(STATIC_TABLE, 1)))
+}
+
+# Codes with the leading 1 bit, which keeps the code length, by symbols
+HUFFMAN_SYMBOLS = {
+    (1 << length) | code: symbol
+    for symbol, (code, length) in enumerate(
+        zip(HUFFMAN_CODES, HUFFMAN_LENGTHS)
+    )
+}
+
+
+def encode_int(value, prefix, flags=0):
+    """ Encodes the integer with the prefix of the given number of bits
+    :param flags: (int) - bits of the first octet above the prefix
+    :return: (bytearray) encoded integer
+    """
+    limit = (1 << prefix) - 1
+    if value < limit:
+        return bytearray((flags | value,))
+    result = bytearray((flags | limit,))
+    value -= limit
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return result
+
+
+def decode_int(data, pos, prefix):
+    """ Decodes the integer with the prefix of the given number of bits
+    :return: (tuple) value and position after the integer
+    """
+    limit = (1 << prefix) - 1
+    value = data[pos] & limit
+    pos += 1
+    if value < limit:
+        return value, pos
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 28:
+            raise ValueError('Invalid integer')
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def huffman_decode(data):
+    result = bytearray()
+    key = 1
+    for byte in data:
+        for shift in range(7, -1, -1):
+            key = key << 1 | byte >> shift & 1
+            symbol = HUFFMAN_SYMBOLS.get(key)
+            if symbol is not None:
+                result.append(symbol)
+                key = 1
+            elif key >> 30:
+                raise ValueError('Invalid Huffman code')
+    # Padding is the most significant bits of EOS, up to 7 bits of ones
+    if key > 0xFF or key & (key + 1):
+        raise ValueError('Invalid Huffman padding')
+    return bytes(result)
+
+
+def encode_str(value):
+    data = value.encode('latin-1')
+    return encode_int(len(data), 7) + data
+
+
+def decode_str(data, pos):
+    """ Decodes the string literal, plain or Huffman coded
+    :return: (tuple) str and position after the string
+    """
+    huffman = data[pos] & 0x80
+    size, pos = decode_int(data, pos, 7)
+    if pos + size > len(data):
+        raise ValueError('String is out of the header block')
+    value = bytes(data[pos:pos + size])
+    if huffman:
+        value = huffman_decode(value)
+    return value.decode('latin-1'), pos + size
+
+
+class Table:
+    """ The static table followed by the dynamic table of the connection """
+
+    def __init__(self, max_size=DEFAULT_TABLE_SIZE):
+        self.entries = deque()
+        self.size = 0
+        self.max_size = max_size
+
+    def get(self, index):
+        if 0 < index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+        index -= len(STATIC_TABLE) + 1
+        if 0 <= index < len(self.entries):
+            return self.entries[index]
+        raise ValueError('Index %d is out of the table' % index)
+
+    def find(self, name, value):
+        """ Looks for the header field in the table
+        :return: (tuple) index of the field or 0, index of the name or 0
+        """
+        index = STATIC_INDEX.get((name, value), 0)
+        if index:
+            return index, index
+        named = STATIC_NAMES.get(name, 0)
+        for number, entry in enumerate(self.entries, len(STATIC_TABLE) + 1):
+            if entry[0] == name:
+                if entry[1] == value:
+                    return number, number
+                named = named or number
+        return 0, named
+
+    def add(self, name, value):
+        size = len(name) + len(value) + ENTRY_OVERHEAD
+        self.entries.appendleft((name, value))
+        self.size += size
+        self.evict()
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size and self.entries:
+            name, value = self.entries.pop()
+            self.size -= len(name) + len(value) + ENTRY_OVERHEAD
+
+
+class Decoder:
+
+    def __init__(self, max_size=DEFAULT_TABLE_SIZE):
+        """
+        :param max_size: (int) - limit of the dynamic table size, announced
+        by the SETTINGS_HEADER_TABLE_SIZE
+        """
+        self.table = Table(max_size)
+        self.max_size = max_size
+
+    def decode(self, data):
+        """ Decodes the header block
+        :param data: (bytes) - header block
+        :return: (list) pairs of the header name and value
+        """
+        headers = []
+        pos = 0
+        while pos < len(data):
+            byte = data[pos]
+            if byte & 0x80:
+                index, pos = decode_int(data, pos, 7)
+                headers.append(self.table.get(index))
+                continue
+            if byte & 0xE0 == 0x20:
+                size, pos = decode_int(data, pos, 5)
+                if size > self.max_size:
+                    raise ValueError('Table size exceeds the limit')
+                self.table.resize(size)
+                continue
+
+            # Literal with incremental indexing, without or never indexed
+            indexing = byte & 0x40
+            index, pos = decode_int(data, pos, 6 if indexing else 4)
+            if index:
+                name = self.table.get(index)[0]
+            else:
+                name, pos = decode_str(data, pos)
+            value, pos = decode_str(data, pos)
+            if indexing:
+                self.table.add(name, value)
+            headers.append((name, value))
+        return headers
+
+
+class Encoder:
+
+    def __init__(self, max_size=DEFAULT_TABLE_SIZE):
+        self.table = Table(max_size)
+        self.__resized = None
+
+    def resize(self, max_size):
+        """ Applies the SETTINGS_HEADER_TABLE_SIZE sent by the peer """
+        max_size = min(max_size, DEFAULT_TABLE_SIZE)
+        if max_size != self.table.max_size:
+            self.table.resize(max_size)
+            self.__resized = max_size
+
+    def encode(self, headers):
+        """ Encodes the header fields
+        :param headers: (list) - pairs of the lower case name and value
+        :return: (bytes) header block
+        """
+        for name, value in headers:
+            # Fields are checked first, so the failed encoding does not
+            # change the table shared with the decoder of the peer
+            name.encode('latin-1')
+            value.encode('latin-1')
+
+        result = bytearray()
+        if self.__resized is not None:
+            result += encode_int(self.__resized, 5, 0x20)
+            self.__resized = None
+
+        for name, value in headers:
+            index, named = self.table.find(name, value)
+            if index:
+                result += encode_int(index, 7, 0x80)
+                continue
+            if name in NOT_INDEXED:
+                result += encode_int(named, 4)
+            else:
+                result += encode_int(named, 6, 0x40)
+                self.table.add(name, value)
+            if not named:
+                result += encode_str(name)
+            result += encode_str(value)
+        return bytes(result)
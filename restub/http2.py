@@ -0,0 +1,507 @@
+"""
+The HTTP/2 connection of the "http2" engine (RFC 9113). The engine serves
+HTTP/1.1 and HTTP/2 on the same port: the plain connection is HTTP/2 if the
+client starts it with the connection preface (prior knowledge), and the
+secure connection if the client selects "h2" by ALPN.
+
+The requests of all streams are read by the thread of the connection, and
+the responses are sent by a pool of threads, so the streams are processed
+concurrently and the delay of one response does not hold the others. Every
+connection keeps its own HPACK state, and the sent data respect the flow
+control windows of the client.
+
+Streams of Server-Sent Events and WebSocket are not served over HTTP/2.
+
+Examples:
+    with Service(routes=['GET', r'/$', 'Hello'], engine='http2') as srv:
+        # curl --http2-prior-knowledge http://localhost:8081/
+"""
+
+
+import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.client import HTTPException
+from threading import Condition
+from time import monotonic, sleep
+
+from restub.hpack import Decoder, Encoder
+
+
+PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+# Frame types
+DATA, HEADERS, PRIORITY, RST_STREAM, SETTINGS, PUSH_PROMISE, PING, GOAWAY, \
+    WINDOW_UPDATE, CONTINUATION = range(10)
+
+# Frame flags
+END_STREAM, ACK, END_HEADERS, PADDED, PRIORITY_FLAG = 0x1, 0x1, 0x4, 0x8, 0x20
+
+# Settings
+HEADER_TABLE_SIZE, ENABLE_PUSH, MAX_CONCURRENT_STREAMS, INITIAL_WINDOW_SIZE, \
+    MAX_FRAME_SIZE, MAX_HEADER_LIST_SIZE = range(1, 7)
+
+# Error codes
+NO_ERROR, PROTOCOL_ERROR, INTERNAL_ERROR, FLOW_CONTROL_ERROR, \
+    SETTINGS_TIMEOUT, STREAM_CLOSED, FRAME_SIZE_ERROR, REFUSED_STREAM, \
+    CANCEL, COMPRESSION_ERROR = range(10)
+
+DEFAULT_WINDOW = 65535
+MAX_WINDOW = 0x7FFFFFFF
+FRAME_SIZE = 16384
+MAX_STREAMS = 100
+
+# Headers of HTTP/1.1 connections, which are not allowed in HTTP/2
+CONNECTION_HEADERS = {
+    'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding',
+    'upgrade',
+}
+
+# Headers of the route which are replaced by the response headers
+SKIP_HEADERS = CONNECTION_HEADERS | {'content-length', 'date', 'server'}
+
+
+class ProtocolError(Exception):
+
+    def __init__(self, message, code=PROTOCOL_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def is_http2(sock):
+    """ Checks if the client starts the HTTP/2 connection
+    :param sock: (socket) - accepted connection, no data is read from it
+    """
+    if hasattr(sock, 'selected_alpn_protocol'):
+        return sock.selected_alpn_protocol() == 'h2'
+    try:
+        data = sock.recv(len(PREFACE), socket.MSG_PEEK)
+        if data and len(data) < len(PREFACE) and PREFACE.startswith(data):
+            flags = socket.MSG_PEEK | socket.MSG_WAITALL
+            data = sock.recv(len(PREFACE), flags)
+    except OSError:
+        return False
+    return data == PREFACE
+
+
+def frame(kind, flags, stream_id, payload=b''):
+    return struct.pack(
+        '!BHBBI', len(payload) >> 16, len(payload) & 0xFFFF, kind, flags,
+        stream_id
+    ) + payload
+
+
+class Stream:
+
+    __slots__ = (
+        'id', 'headers', 'body', 'block', 'window', 'received', 'reset',
+        'responded'
+    )
+
+    def __init__(self, stream_id, window):
+        self.id = stream_id
+        self.headers = None
+        self.body = bytearray()
+        self.block = bytearray()
+        self.window = window
+        self.received = False
+        self.reset = False
+        self.responded = False
+
+    @property
+    def method(self):
+        return self.headers.get(':method', '')
+
+    @property
+    def path(self):
+        return self.headers.get(':path', '')
+
+
+class Connection:
+
+    def __init__(self, handler, service):
+        """
+        :param handler: (BaseHTTPRequestHandler) - handler of the connection
+        :param service: (Service) - service resolving the requests
+        """
+        self.service = service
+        self.sock = handler.connection
+        self.rfile = handler.rfile
+        self.decoder = Decoder()
+        self.encoder = Encoder()
+        self.streams = {}
+        self.last_id = 0
+        self.window = DEFAULT_WINDOW
+        self.initial_window = DEFAULT_WINDOW
+        self.frame_size = FRAME_SIZE
+        self.closed = False
+        self.goaway = False
+        self.__continued = None
+        self.__condition = Condition()
+        self.__pool = ThreadPoolExecutor(MAX_STREAMS)
+        self.__frames = {
+            DATA: self.on_data,
+            HEADERS: self.on_headers,
+            PRIORITY: self.on_priority,
+            RST_STREAM: self.on_reset,
+            SETTINGS: self.on_settings,
+            PUSH_PROMISE: self.on_push_promise,
+            PING: self.on_ping,
+            GOAWAY: self.on_goaway,
+            WINDOW_UPDATE: self.on_window_update,
+            CONTINUATION: self.on_continuation,
+        }
+
+    def serve(self):
+        try:
+            if self.rfile.read(len(PREFACE)) != PREFACE:
+                return
+            self.send(SETTINGS, 0, 0, struct.pack(
+                '!HIHI', MAX_CONCURRENT_STREAMS, MAX_STREAMS,
+                MAX_FRAME_SIZE, FRAME_SIZE
+            ))
+            while not self.closed:
+                self.read_frame()
+        except ProtocolError as e:
+            self.send(GOAWAY, 0, 0, struct.pack('!II', self.last_id, e.code))
+            self.service.log('HTTP/2 connection error: %s' % e)
+        except OSError:
+            pass
+        finally:
+            # Streams waiting for the window are released before the pool
+            self.close()
+            self.__pool.shutdown()
+
+    def close(self):
+        with self.__condition:
+            self.closed = True
+            self.__condition.notify_all()
+
+    def read_frame(self):
+        header = self.rfile.read(9)
+        if len(header) < 9:
+            self.close()
+            return
+        high, low, kind, flags, stream_id = struct.unpack('!BHBBI', header)
+        size, stream_id = high << 16 | low, stream_id & MAX_WINDOW
+        if size > FRAME_SIZE:
+            raise ProtocolError('Frame is too large', FRAME_SIZE_ERROR)
+        payload = self.rfile.read(size)
+        if len(payload) < size:
+            self.close()
+            return
+        if self.__continued is not None and kind != CONTINUATION:
+            raise ProtocolError('Header block is not continued')
+        # Frames of unknown types are ignored
+        handler = self.__frames.get(kind)
+        if handler:
+            handler(flags, stream_id, payload)
+
+    def send(self, kind, flags, stream_id, payload=b''):
+        with self.__condition:
+            self.sock.sendall(frame(kind, flags, stream_id, payload))
+
+    def send_headers(self, stream, headers, end_stream):
+        """ Encodes and sends the headers, split by the frame size """
+        with self.__condition:
+            if stream.reset or self.closed:
+                return False
+            block = self.encoder.encode(headers)
+            size = self.frame_size
+            chunks = [block[i:i + size] for i in range(0, len(block), size)]
+            for number, chunk in enumerate(chunks):
+                if number:
+                    kind, flags = CONTINUATION, 0
+                else:
+                    kind, flags = HEADERS, END_STREAM if end_stream else 0
+                if number == len(chunks) - 1:
+                    flags |= END_HEADERS
+                self.sock.sendall(frame(kind, flags, stream.id, chunk))
+            stream.responded = True
+            return True
+
+    def send_data(self, stream, data):
+        """ Sends the data as the flow control windows allow
+        :return: (bool) False if the stream or the connection is closed
+        """
+        view, offset = memoryview(data), 0
+        with self.__condition:
+            while offset < len(data):
+                while not (stream.reset or self.closed) and \
+                        min(self.window, stream.window) <= 0:
+                    self.__condition.wait()
+                if stream.reset or self.closed:
+                    return False
+                size = min(
+                    len(data) - offset, self.window, stream.window,
+                    self.frame_size
+                )
+                self.window -= size
+                stream.window -= size
+                offset += size
+                self.sock.sendall(frame(
+                    DATA, END_STREAM if offset == len(data) else 0,
+                    stream.id, bytes(view[offset - size:offset])
+                ))
+        return True
+
+    def reset(self, stream_id, code):
+        self.send(RST_STREAM, 0, stream_id, struct.pack('!I', code))
+
+    def on_data(self, flags, stream_id, payload):
+        data = self.unpad(flags, payload)
+        if payload:
+            # Received data are processed at once, so the windows are restored
+            increment = struct.pack('!I', len(payload))
+            self.send(WINDOW_UPDATE, 0, 0, increment)
+        stream = self.streams.get(stream_id)
+        if stream is None or stream.received:
+            if not stream_id or stream_id > self.last_id:
+                raise ProtocolError('Data of idle stream')
+            self.reset(stream_id, STREAM_CLOSED)
+            return
+        if payload and not flags & END_STREAM:
+            self.send(WINDOW_UPDATE, 0, stream_id, increment)
+        stream.body += data
+        if flags & END_STREAM:
+            self.dispatch(stream)
+
+    def on_headers(self, flags, stream_id, payload):
+        data = self.unpad(flags, payload)
+        if flags & PRIORITY_FLAG:
+            data = data[5:]
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if not stream_id % 2 or stream_id <= self.last_id:
+                raise ProtocolError('Invalid stream %d' % stream_id)
+            self.last_id = stream_id
+            stream = Stream(stream_id, self.initial_window)
+            with self.__condition:
+                self.streams[stream_id] = stream
+        elif stream.received:
+            raise ProtocolError('Stream %d is closed' % stream_id)
+        stream.block += data
+        # The flag is kept in the block, until the last continuation
+        stream.received = bool(flags & END_STREAM)
+        self.__continued = stream_id
+        if flags & END_HEADERS:
+            self.decode(stream)
+
+    def on_continuation(self, flags, stream_id, payload):
+        if stream_id != self.__continued:
+            raise ProtocolError('Unexpected continuation')
+        stream = self.streams[stream_id]
+        stream.block += payload
+        if flags & END_HEADERS:
+            self.decode(stream)
+
+    def on_priority(self, flags, stream_id, payload):
+        if len(payload) != 5:
+            raise ProtocolError('Invalid priority', FRAME_SIZE_ERROR)
+
+    def on_reset(self, flags, stream_id, payload):
+        with self.__condition:
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                stream.reset = True
+                self.__condition.notify_all()
+
+    def on_settings(self, flags, stream_id, payload):
+        if stream_id or len(payload) % 6:
+            raise ProtocolError('Invalid settings', FRAME_SIZE_ERROR)
+        if flags & ACK:
+            return
+        with self.__condition:
+            for offset in range(0, len(payload), 6):
+                key, value = struct.unpack('!HI', payload[offset:offset + 6])
+                if key == HEADER_TABLE_SIZE:
+                    self.encoder.resize(value)
+                elif key == INITIAL_WINDOW_SIZE:
+                    if value > MAX_WINDOW:
+                        raise ProtocolError(
+                            'Window is too large', FLOW_CONTROL_ERROR
+                        )
+                    for stream in self.streams.values():
+                        stream.window += value - self.initial_window
+                    self.initial_window = value
+                elif key == MAX_FRAME_SIZE:
+                    if not FRAME_SIZE <= value <= 0xFFFFFF:
+                        raise ProtocolError('Invalid frame size')
+                    self.frame_size = value
+            self.__condition.notify_all()
+        self.send(SETTINGS, ACK, 0)
+
+    def on_push_promise(self, flags, stream_id, payload):
+        raise ProtocolError('Client cannot push')
+
+    def on_ping(self, flags, stream_id, payload):
+        if len(payload) != 8:
+            raise ProtocolError('Invalid ping', FRAME_SIZE_ERROR)
+        if not flags & ACK:
+            self.send(PING, ACK, 0, payload)
+
+    def on_goaway(self, flags, stream_id, payload):
+        # Frames are read until the streams in progress are finished, as
+        # they can wait for the window updates
+        with self.__condition:
+            self.goaway = True
+            if not self.streams:
+                self.closed = True
+
+    def stop_reading(self):
+        """ Wakes the reading thread by the end of the input """
+        try:
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    def on_window_update(self, flags, stream_id, payload):
+        if len(payload) != 4:
+            raise ProtocolError('Invalid window update', FRAME_SIZE_ERROR)
+        increment = struct.unpack('!I', payload)[0] & MAX_WINDOW
+        if not increment:
+            raise ProtocolError('Window increment is zero')
+        with self.__condition:
+            if not stream_id:
+                self.window += increment
+                if self.window > MAX_WINDOW:
+                    raise ProtocolError(
+                        'Window is too large', FLOW_CONTROL_ERROR
+                    )
+            elif stream_id in self.streams:
+                self.streams[stream_id].window += increment
+            self.__condition.notify_all()
+
+    def decode(self, stream):
+        self.__continued = None
+        try:
+            fields = self.decoder.decode(stream.block)
+        except (IndexError, ValueError) as e:
+            raise ProtocolError(str(e), COMPRESSION_ERROR)
+        stream.block = bytearray()
+        if stream.headers is not None:
+            # Trailers of the request are not used
+            if stream.received:
+                self.dispatch(stream)
+            return
+
+        headers = {}
+        for name, value in fields:
+            if name == ':authority':
+                name = 'host'
+            if name in headers:
+                separator = '; ' if name == 'cookie' else ', '
+                value = headers[name] + separator + value
+            headers[name] = value
+        stream.headers = headers
+
+        if len(self.streams) > MAX_STREAMS:
+            with self.__condition:
+                del self.streams[stream.id]
+            self.reset(stream.id, REFUSED_STREAM)
+        elif stream.received:
+            self.dispatch(stream)
+
+    def dispatch(self, stream):
+        stream.received = True
+        self.__pool.submit(self.respond, stream)
+
+    @staticmethod
+    def unpad(flags, payload):
+        if not flags & PADDED:
+            return payload
+        if not payload or payload[0] >= len(payload):
+            raise ProtocolError('Invalid padding')
+        return payload[1:len(payload) - payload[0]]
+
+    def respond(self, stream):
+        service = self.service
+        started, status, sent = monotonic(), 0, 0
+        profiler = service.profiler
+        timing = profiler and profiler.begin(stream.method, stream.path)
+        try:
+            status, sent = self.process(stream, timing)
+        except OSError:
+            pass
+        except Exception as e:
+            status = 500
+            service.log('HTTP/2 error %s "%s": %r' % (
+                stream.method, stream.path, e
+            ))
+            try:
+                if stream.responded:
+                    self.reset(stream.id, INTERNAL_ERROR)
+                else:
+                    self.send_headers(stream, [(':status', '500')], True)
+            except OSError:
+                pass
+        finally:
+            with self.__condition:
+                self.streams.pop(stream.id, None)
+                finished = self.goaway and not self.streams
+            if finished:
+                self.stop_reading()
+            service.metrics.record(status, sent, monotonic() - started)
+            if timing:
+                profiler.end(timing, status)
+
+    def process(self, stream, timing):
+        """ Sends the response of the stream
+        :return: (tuple) status code and size of the sent body
+        """
+        from restub.server import trace_info
+
+        service = self.service
+        profiler = service.profiler
+        mark = timing and profiler.mark
+        method, path = stream.method, stream.path
+        headers = {
+            k: v for k, v in stream.headers.items() if not k.startswith(':')
+        }
+        body = bytes(stream.body)
+
+        if mark:
+            mark(timing, 'before_resolve')
+        route = service.resolve(method, path, headers, body)
+        if not route and service.proxy:
+            try:
+                route = service.forward(method, path, headers, body)
+            except (HTTPException, OSError) as e:
+                self.send_headers(stream, [(':status', '502')], True)
+                service.log('Proxy error %s "%s": %s' % (method, path, e))
+                return 502, 0
+        if mark:
+            mark(timing, 'after_resolve')
+        if not route:
+            self.send_headers(stream, [(':status', '404')], True)
+            service.log('Not found %s "%s"' % (method, path))
+            return 404, 0
+
+        data = bytes(route.data) if route.data else b''
+        fields = [
+            (':status', str(route.status)),
+            ('server', 'Restub Service'),
+            ('date', formatdate(usegmt=True)),
+        ]
+        fields += [
+            (k.lower(), str(v)) for k, v in route.headers.items()
+            if k.lower() not in SKIP_HEADERS
+        ]
+        fields.append(('content-length', str(len(data))))
+        self.send_headers(stream, fields, not data)
+
+        sleep(service.delay)
+
+        if mark:
+            mark(timing, 'before_write')
+        sent = len(data) if data and self.send_data(stream, data) else 0
+        if mark:
+            mark(timing, 'after_write')
+
+        if service.trace:
+            service.log(trace_info(
+                'HTTP/2 %s' % method, path, route.status, headers.items(),
+                fields[1:], body
+            ))
+        return route.status, sent
@@ -0,0 +1,257 @@
+"""
+The Matcher is an index over a table of routes which resolves an incoming
+request to the first suitable route in the order of registration.
+
+Routes are grouped by the method of access, and routes with a literal path
+(for example r'/users/$') are found by a dictionary lookup instead of trying
+every regex. The remaining checks are made from cheap to expensive: a path
+regex, the headers, the query string and at last the body. The query string
+and the body of a request are parsed only when a candidate route has reached
+the corresponding check, and at most once per request.
+
+Examples:
+    matcher = Matcher(routes)
+    route = matcher.resolve(Request('GET', '/users/?page=2', headers))
+"""
+
+
+import json
+import re
+from heapq import merge
+from sys import getsizeof
+from urllib.parse import parse_qs, urlsplit
+
+
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+def literal_path(path):
+    """ Returns the exact address described by the path regex or None
+    :param path: (str) path regex of a route
+    :return: (str, None) address if the path is literal and anchored by "$"
+    """
+    if path.startswith('^'):
+        path = path[1:]
+    if not path.endswith('$') or path.endswith('\\$'):
+        return None
+    path = path[:-1]
+    if REGEX_CHARS.intersection(path):
+        return None
+    return path
+
+
+class Request:
+    """ Lazy view of an incoming request used while resolving a route """
+
+    __slots__ = (
+        'method', 'path', '__headers', '__body', '__bare', '__query', '__json'
+    )
+
+    def __init__(self, method, path, headers=None, body=None):
+        """
+        :param method: (str) - access method
+        :param path: (str) - requested address with the query string
+        :param headers: (dict, Message) - HTTP request headers
+        :param body: (bytes, callable) - request body or function reading it
+        """
+        self.method = method
+        self.path = path
+        if isinstance(headers, dict):
+            headers = {k.lower(): v for k, v in headers.items()}
+        self.__headers = headers if headers is not None else {}
+        self.__body = body
+        self.__bare = None
+        self.__query = None
+        self.__json = None
+
+    @property
+    def bare_path(self):
+        """ Requested address without the query string """
+        if self.__bare is None:
+            self.__bare = self.path.split('?', 1)[0]
+        return self.__bare
+
+    @property
+    def query(self):
+        if self.__query is None:
+            self.__query = parse_qs(urlsplit(self.path).query, True)
+        return self.__query
+
+    @property
+    def body(self):
+        if callable(self.__body):
+            self.__body = self.__body()
+        return self.__body or b''
+
+    @property
+    def json(self):
+        if self.__json is None:
+            try:
+                self.__json = json.loads(self.body.decode())
+            except (UnicodeDecodeError, ValueError):
+                self.__json = False
+        return self.__json
+
+    def header(self, name):
+        return self.__headers.get(name.lower())
+
+
+class Entry:
+    """ A route with the compiled predicates, ready to be matched """
+
+    __slots__ = 'order', 'path', 'headers', 'query', 'body', 'bare'
+
+    def __init__(self, order, route, literal=False):
+        self.order = order
+        self.bare = route.match_query is not None
+        # Regex of the path is compiled on the first use
+        self.path = None if literal else route.path
+        self.headers = self.compile(route.match_headers)
+        self.query = self.compile(route.match_query)
+        self.body = route.match_body
+        if isinstance(self.body, str):
+            self.body = re.compile(self.body, re.U)
+
+    @staticmethod
+    def compile(predicates):
+        if not predicates:
+            return ()
+        return tuple(
+            (name, re.compile(value, re.U) if value is not None else None)
+            for name, value in predicates.items()
+        )
+
+    def match(self, request):
+        if self.path is not None:
+            if isinstance(self.path, str):
+                self.path = re.compile(self.path, re.U)
+            target = request.bare_path if self.bare else request.path
+            if not self.path.match(target):
+                return False
+
+        for name, regex in self.headers:
+            value = request.header(name)
+            if value is None or regex and not regex.match(value):
+                return False
+
+        if self.query:
+            query = request.query
+            for name, regex in self.query:
+                values = query.get(name)
+                if values is None:
+                    return False
+                if regex and not any(regex.match(v) for v in values):
+                    return False
+
+        if self.body is not None:
+            if isinstance(self.body, dict):
+                data = request.json
+                if not isinstance(data, dict):
+                    return False
+                for key, value in self.body.items():
+                    if key not in data or data[key] != value:
+                        return False
+            elif not self.body.search(request.body.decode(errors='replace')):
+                return False
+
+        return True
+
+
+def order(item):
+    return item if isinstance(item, int) else item.order
+
+
+class Matcher:
+
+    def __init__(self, routes):
+        """
+        :param routes: (list, RouteTable) - routes in the order of registration
+        """
+        self.__routes = routes
+        self.__exact = {}
+        self.__regex = {}
+
+        for index, route in enumerate(routes):
+            if literal_path(route.path) is None:
+                entry = Entry(index, route)
+                self.__regex.setdefault(route.method, []).append(entry)
+                continue
+
+            bare = route.match_query is not None
+            if route.match_headers or route.match_query or \
+                    route.match_body is not None:
+                item = Entry(index, route, literal=True)
+            else:
+                # Nothing to check for a literal path without predicates
+                item = index
+            # The path itself is the key, so it is shared with the route
+            key = route.path[1:] if route.path.startswith('^') else route.path
+            paths = self.__exact.setdefault((route.method, bare), {})
+            items = paths.get(key)
+            if items is None:
+                paths[key] = item
+            elif isinstance(items, list):
+                items.append(item)
+            else:
+                paths[key] = [items, item]
+
+    def __lookup(self, method, bare, path):
+        paths = self.__exact.get((method, bare))
+        if paths is None:
+            return ()
+        items = paths.get(path + '$')
+        if items is None:
+            return ()
+        return items if isinstance(items, list) else (items,)
+
+    def candidates(self, request):
+        """ Yields the numbers of routes or entries to check, in the order of
+        registration
+        """
+        method = request.method
+        exact = self.__lookup(method, False, request.path)
+        bare = self.__lookup(method, True, request.bare_path)
+        regex = self.__regex.get(method, ())
+        if not bare and not regex:
+            return exact
+        return merge(exact, bare, regex, key=order)
+
+    def resolve(self, request):
+        """ Finds the first route suitable for the request
+        :param request: (Request) - incoming request
+        :return: (Route, None) suitable route or None if nothing found
+        """
+        for item in self.candidates(request):
+            if isinstance(item, int):
+                return self.__routes[item]
+            if item.match(request):
+                return self.__routes[item.order]
+        return None
+
+    def memory(self):
+        """ Estimates the memory used by the index
+        :return: (int) bytes
+        """
+        size = getsizeof(self.__exact) + getsizeof(self.__regex)
+        for paths in self.__exact.values():
+            size += getsizeof(paths)
+            for items in paths.values():
+                if isinstance(items, list):
+                    size += getsizeof(items)
+                    size += sum(self.__sizeof(item) for item in items)
+                else:
+                    size += self.__sizeof(items)
+        for entries in self.__regex.values():
+            size += getsizeof(entries)
+            size += sum(self.__sizeof(entry) for entry in entries)
+        return size
+
+    @staticmethod
+    def __sizeof(item):
+        if isinstance(item, int):
+            return getsizeof(item)
+        size = getsizeof(item) + getsizeof(item.headers)
+        size += getsizeof(item.query)
+        if item.path is not None and not isinstance(item.path, str):
+            size += getsizeof(item.path)
+        return size
@@ -0,0 +1,74 @@
+"""
+The Metrics collects counters of the requests processed by the Service: the
+number of requests per status code, the number of sent bytes and the time of
+processing. The counters of several processes can be merged into one.
+
+Examples:
+    with Service(routes=['GET', r'/$']) as srv:
+        # your requests here
+        print(srv.metrics.summary())
+"""
+
+
+from threading import Lock
+
+
+class Metrics:
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.requests = 0
+        self.sent = 0
+        self.elapsed = 0.0
+        self.slowest = 0.0
+        self.statuses = {}
+
+    def record(self, status, sent, elapsed):
+        """ Counts the processed request
+        :param status: (int) - code of the response status
+        :param sent: (int) - size of the response body in bytes
+        :param elapsed: (float) - time of processing in seconds
+        """
+        with self.__lock:
+            self.requests += 1
+            self.sent += sent
+            self.elapsed += elapsed
+            self.slowest = max(self.slowest, elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        """ Adds the counters of other metrics, given as Metrics or dict """
+        if isinstance(other, Metrics):
+            other = other.as_dict()
+        with self.__lock:
+            self.requests += other['requests']
+            self.sent += other['sent']
+            self.elapsed += other['elapsed']
+            self.slowest = max(self.slowest, other['slowest'])
+            for status, count in other['statuses'].items():
+                status = int(status)
+                self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def as_dict(self):
+        with self.__lock:
+            return {
+                'requests': self.requests,
+                'sent': self.sent,
+                'elapsed': self.elapsed,
+                'slowest': self.slowest,
+                'statuses': dict(self.statuses),
+            }
+
+    def summary(self):
+        info = self.as_dict()
+        mean = info['elapsed'] / info['requests'] if info['requests'] else 0
+        statuses = ', '.join(
+            '%d: %d' % (k, v) for k, v in sorted(info['statuses'].items())
+        )
+        return (
+            'Requests: %d, sent: %d bytes, mean: %.3f ms, max: %.3f ms'
+            '\nStatuses: %s' % (
+                info['requests'], info['sent'], mean * 1000,
+                info['slowest'] * 1000, statuses or '-'
+            )
+        )
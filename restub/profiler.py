@@ -0,0 +1,221 @@
+"""
+The Profiler shows where the time of slow requests goes. Every request gets
+a Timing with monotonic timestamps of its phases:
+
+    * before_resolve - the request line and headers are parsed
+
+    * after_resolve - the route is found, or the proxy returned the response
+
+    * before_write - headers are sent and the delay is over
+
+    * after_write - the body is written to the socket
+
+The time after the last phase is spent on the trace log and on closing the
+connection. Callbacks added by hook are called at every phase with the Timing
+and the name of the phase.
+
+The Profiler keeps the N slowest requests. When a threshold is set, the
+sampling thread periodically takes the stacks of the requests running longer
+than the threshold, so the dump of the slowest requests shows where they
+were waiting.
+
+Examples:
+    opts = {'profile': 10, 'profile_threshold': 0.05}
+    with Service(routes=['GET', r'/$'], **opts) as srv:
+        srv.hook('after_resolve', lambda timing, phase: print(timing))
+        # your requests here
+        print(srv.profiler.dump())
+"""
+
+
+import sys
+from collections import Counter, OrderedDict
+from heapq import heappush, heappushpop
+from itertools import count
+from threading import Event, Lock, Thread, get_ident
+from time import monotonic
+from traceback import extract_stack
+
+
+PHASES = ('before_resolve', 'after_resolve', 'before_write', 'after_write')
+
+# Names of the intervals ending at the phases, shown by the dump
+SPANS = {
+    'after_resolve': 'resolve',
+    'before_write': 'respond',
+    'after_write': 'write',
+}
+
+
+class Timing:
+
+    __slots__ = (
+        'method', 'path', 'status', 'started', 'finished', 'marks', 'samples'
+    )
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.status = 0
+        self.started = monotonic()
+        self.finished = None
+        self.marks = {}
+        self.samples = Counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or monotonic()) - self.started
+
+    def phases(self):
+        """ Splits the time of the request by the passed phases
+        :return: (OrderedDict) seconds spent between the phases by span names
+        """
+        result = OrderedDict()
+        previous = self.started
+        for phase in PHASES:
+            if phase in self.marks:
+                if phase in SPANS:
+                    result[SPANS[phase]] = self.marks[phase] - previous
+                previous = self.marks[phase]
+        if self.finished is not None:
+            result['finish'] = self.finished - previous
+        return result
+
+    def __str__(self):
+        return '<Timing[%s %s, %.3f ms]>' % (
+            self.method, self.path, self.elapsed * 1000
+        )
+
+
+class Profiler:
+
+    def __init__(self, slowest=10, threshold=None, interval=0.005,
+                 depth=8, max_samples=1000):
+        """
+        :param slowest: (int) - number of the slowest requests to keep
+        :param threshold: (int, float) - duration in seconds after which
+        stacks of the request are sampled, sampling is off if None
+        :param interval: (int, float) - interval between samples in seconds
+        :param depth: (int) - number of the innermost frames in a sample
+        :param max_samples: (int) - maximum number of samples per request
+        """
+        self.slowest = int(slowest)
+        self.threshold = threshold
+        self.interval = interval
+        self.depth = depth
+        self.max_samples = max_samples
+        self.hooks = {phase: [] for phase in PHASES}
+        self.__lock = Lock()
+        self.__active = {}
+        self.__heap = []
+        self.__counter = count()
+        self.__stopped = Event()
+        self.__sampler = None
+
+    def hook(self, phase, callback):
+        """ Adds the function called with the Timing and the phase name """
+        if phase not in self.hooks:
+            raise ValueError('Phase "%s" is not supported' % phase)
+        if not callable(callback):
+            raise TypeError('Callback should be callable')
+        self.hooks[phase].append(callback)
+
+    def start(self):
+        if self.threshold is not None and self.__sampler is None:
+            self.__stopped.clear()
+            self.__sampler = Thread(target=self.__sample, daemon=True)
+            self.__sampler.start()
+
+    def stop(self):
+        if self.__sampler is not None:
+            self.__stopped.set()
+            self.__sampler.join()
+            self.__sampler = None
+
+    def begin(self, method, path):
+        """ Starts the Timing of the request processed by the current thread
+        """
+        timing = Timing(method, path)
+        with self.__lock:
+            self.__active[get_ident()] = timing
+        return timing
+
+    def mark(self, timing, phase):
+        timing.marks[phase] = monotonic()
+        for callback in self.hooks[phase]:
+            callback(timing, phase)
+
+    def end(self, timing, status):
+        timing.finished = monotonic()
+        timing.status = status
+        entry = (timing.elapsed, next(self.__counter), timing)
+        with self.__lock:
+            self.__active.pop(get_ident(), None)
+            if self.slowest <= 0:
+                return
+            if len(self.__heap) < self.slowest:
+                heappush(self.__heap, entry)
+            else:
+                heappushpop(self.__heap, entry)
+
+    def requests(self):
+        """ Returns the Timings of the slowest requests, slowest first """
+        with self.__lock:
+            entries = sorted(self.__heap, reverse=True)
+        return [timing for _, _, timing in entries]
+
+    def clear(self):
+        with self.__lock:
+            self.__heap = []
+
+    def dump(self, limit=None, samples=5):
+        """ Formats the slowest requests with their phases and stack samples
+        :param limit: (int) - number of the requests, by default all kept
+        :param samples: (int) - number of the most frequent stacks per request
+        :return: (str) report
+        """
+        timings = self.requests()[:limit]
+        if not timings:
+            return 'Slowest requests: -'
+
+        lines = ['Slowest requests:']
+        for number, timing in enumerate(timings, 1):
+            lines.append('%d. %s "%s" %d in %.3f ms' % (
+                number, timing.method, timing.path, timing.status,
+                timing.elapsed * 1000
+            ))
+            lines.append('   ' + ', '.join(
+                '%s: %.3f ms' % (name, spent * 1000)
+                for name, spent in timing.phases().items()
+            ))
+            total = sum(timing.samples.values())
+            if total:
+                lines.append('   Samples: %d' % total)
+            for stack, hits in timing.samples.most_common(samples):
+                lines.append('   %5d  %s' % (hits, ' > '.join(stack)))
+        return '\n'.join(lines)
+
+    def __sample(self):
+        while not self.__stopped.wait(self.interval):
+            now = monotonic()
+            with self.__lock:
+                active = [
+                    (ident, timing) for ident, timing in self.__active.items()
+                    if now - timing.started >= self.threshold
+                ]
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, timing in active:
+                frame = frames.get(ident)
+                total = sum(timing.samples.values())
+                if frame is None or timing.finished is not None or \
+                        total >= self.max_samples:
+                    continue
+                stack = extract_stack(frame, self.depth)
+                timing.samples[tuple(
+                    '%s:%d %s' % (
+                        entry.filename.rsplit('/', 1)[-1], entry.lineno,
+                        entry.name
+                    ) for entry in stack
+                )] += 1
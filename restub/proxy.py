@@ -0,0 +1,200 @@
+"""
+In the proxy mode the Service forwards requests which have no suitable route
+to the target upstream, and returns its response to the client. Connections
+to the upstream are kept alive and reused between the requests.
+
+When a cache directory is defined, every forwarded response is recorded
+there. Bodies are stored by their SHA-256, so equal bodies share one file,
+and each pair of method and path keeps the last received response. Later the
+cache can be replayed as a list of routes, without the upstream.
+
+Examples:
+    # Forward unknown requests and record the responses
+    with Service(proxy='http://example.com', cache='fixtures') as srv:
+        # your requests here
+
+    # Replay the recorded responses
+    with Service(routes=Cache('fixtures').routes()) as srv:
+        # your requests here
+"""
+
+
+import json
+import os
+import re
+from hashlib import sha256
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from pathlib import Path
+from queue import Empty, Full, LifoQueue
+from threading import Lock
+from urllib.parse import urlsplit
+
+from restub.route import Route
+
+
+HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host',
+}
+
+SKIP_HEADERS = HOP_HEADERS | {'content-length', 'date', 'server'}
+
+# Methods which are safe to send again if the reused connection failed
+IDEMPOTENT = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'}
+
+
+def request_headers(headers):
+    """ Filters the request headers which should not be forwarded """
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS}
+
+
+def response_headers(headers):
+    """ Filters the response headers which are set by the Service itself
+    :param headers: (list) pairs of the upstream response headers
+    :return: (dict) headers of the route
+    """
+    result = {}
+    for name, value in headers:
+        if name.lower() in SKIP_HEADERS:
+            continue
+        if name.lower() == 'content-type':
+            name = 'Content-type'
+        result[name] = value
+    return result
+
+
+def make_route(method, path, status, headers, body):
+    """ Creates the route which returns exactly the received response """
+    return Route(method, re.escape(path) + '$', body or None, headers, status)
+
+
+class Pool:
+
+    def __init__(self, url, size=8, timeout=10):
+        """
+        :param url: (str) - address of the upstream, http or https
+        :param size: (int) - maximum number of the idle connections
+        :param timeout: (int, float) - socket timeout in seconds
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('Proxy should be http or https address')
+
+        self.__cls = HTTPSConnection if parts.scheme == 'https' else \
+            HTTPConnection
+        self.__host = parts.hostname
+        self.__port = parts.port
+        self.__prefix = parts.path.rstrip('/')
+        self.__timeout = timeout
+        self.__idle = LifoQueue(size)
+
+    def request(self, method, path, headers=None, body=None):
+        """ Sends the request through the idle or a new connection
+        :return: (tuple) status (int), headers (list), body (bytes)
+        """
+        conn, reused = self.__acquire()
+        try:
+            return self.__send(conn, method, path, headers, body)
+        except (HTTPException, OSError):
+            conn.close()
+            if not reused or method.upper() not in IDEMPOTENT:
+                raise
+        # The idle connection could be closed by the upstream, so try again
+        return self.__send(self.__connect(), method, path, headers, body)
+
+    def close(self):
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except Empty:
+                return
+
+    def __send(self, conn, method, path, headers, body):
+        conn.request(method, self.__prefix + path, body, headers or {})
+        res = conn.getresponse()
+        data = res.read()
+        if res.will_close:
+            conn.close()
+        else:
+            self.__release(conn)
+        return res.status, res.getheaders(), data
+
+    def __connect(self):
+        return self.__cls(self.__host, self.__port, timeout=self.__timeout)
+
+    def __acquire(self):
+        try:
+            return self.__idle.get_nowait(), True
+        except Empty:
+            return self.__connect(), False
+
+    def __release(self, conn):
+        try:
+            self.__idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+
+class Cache:
+
+    def __init__(self, path):
+        """
+        :param path: (str) - directory of the cache, created if not exists
+        """
+        try:
+            self.__path = Path(path)
+        except TypeError:
+            raise TypeError('Cache path should be str')
+        self.__lock = Lock()
+
+    @property
+    def path(self):
+        return self.__path
+
+    def store(self, method, path, status, headers, body):
+        """ Records the response received for the method and path """
+        digest = None
+        if body:
+            digest = sha256(body).hexdigest()
+            self.__write(self.path.joinpath('bodies', digest), body, False)
+
+        entry = {
+            'method': method,
+            'path': path,
+            'status': status,
+            'headers': headers,
+            'body': digest,
+        }
+        key = sha256(('%s %s' % (method, path)).encode()).hexdigest()
+        data = json.dumps(entry, indent=2, sort_keys=True).encode()
+        self.__write(self.path.joinpath('routes', key + '.json'), data)
+
+    def routes(self):
+        """ Loads the recorded responses
+        :return: (list) routes sorted by method and path
+        """
+        entries = []
+        for item in self.path.joinpath('routes').glob('*.json'):
+            entries.append(json.loads(item.read_bytes().decode()))
+        entries.sort(key=lambda e: (e['method'], e['path']))
+
+        routes = []
+        for entry in entries:
+            body = None
+            if entry['body']:
+                body = self.path.joinpath('bodies', entry['body']).read_bytes()
+            routes.append(make_route(
+                entry['method'], entry['path'], entry['status'],
+                entry['headers'], body
+            ))
+        return routes
+
+    def __write(self, target, data, replace=True):
+        with self.__lock:
+            if not replace and target.exists():
+                return
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temp = target.with_name(target.name + '.tmp')
+            with temp.open('wb') as f:
+                f.write(data)
+            os.replace(temp.as_posix(), target.as_posix())
@@ -48,19 +48,35 @@ Examples:
     route = Route('GET', r'/$', {'key': 'value'})
     # as application/json too
     route = Route('GET', r'/$', "{'key': 'value'}")
+    # as application/octet-stream
+    route = Route('GET', r'/$', b'\x00\x01')
 
     # Passing and override headers
     route = Route('GET', r'/$', None, {'X-HEADER': 'VALUE'})
 
     # Passing of status code
     route = Route('GET', r'/$', 'Internal error', None, 500)
+
+A route can also be limited by the request headers, the query string and the
+body. Values of the headers and the query parameters are regex, like a path,
+and None means that the header or the parameter should only be present. A
+dict passed as body predicate should be contained in the JSON body of the
+request, a str is a regex searched in the body. When the query predicates are
+set, the path is matched without the query string.
+
+Examples:
+    # Only for clients accepting xml
+    route = Route('GET', r'/$', match_headers={'Accept': 'application/xml'})
+    # Only for the second page
+    route = Route('GET', r'/items/$', match_query={'page': '2$'})
+    # Only for requests with a JSON field
+    route = Route('POST', r'/login/$', match_body={'user': 'admin'})
 """
 
 
 import json
-from pathlib import Path
-from xml.dom.minidom import parseString
-from xml.parsers.expat import ExpatError
+from collections import namedtuple
+from os.path import isfile, splitext
 
 
 CTYPES = {
@@ -121,6 +137,10 @@ CTYPES = {
 }
 
 
+Body = namedtuple('Body', 'data ctype')
+Body.__doc__ = """ Parsed response data, can be shared by several routes """
+
+
 class Method:
     ALLOWED = ['GET', 'POST', 'PUT', 'DELETE']
     GET, POST, PUT, DELETE = ALLOWED
@@ -137,6 +157,9 @@ def is_json(data):
 
 def is_xml(data):
     """ Checks if data is XML content """
+    from xml.dom.minidom import parseString
+    from xml.parsers.expat import ExpatError
+
     try:
         parseString(data)
     except ExpatError:
@@ -153,41 +176,139 @@ def is_html(data):
 
 def parse_response(obj):
     """ Parses a response data and select the suitable content-type
-    :param obj: (str, dict) response data
+    :param obj: (str, dict, bytes) response data
     :return: (tuple) data (bytes), content-type (str)
     """
-    if isinstance(obj, dict):
+    if isinstance(obj, bytes):
+        return obj, 'application/octet-stream'
+    elif isinstance(obj, dict):
         return bytes(json.dumps(obj).encode()), 'application/json'
     elif isinstance(obj, str):
         try:
             with open(obj, 'rb') as f:
                 data = f.read()
-            return data, CTYPES.get(Path(obj).suffix, 'text/plain')
+            return data, CTYPES.get(splitext(obj)[1], 'text/plain')
         except (FileNotFoundError, OSError, IOError):
-            if is_json(obj):
-                ctype = 'application/json'
-            elif is_html(obj):
-                ctype = 'text/html'
-            elif is_xml(obj):
-                ctype = 'application/xml'
+            return parse_text(obj)
+    else:
+        raise TypeError('Response data should be str, dict or bytes')
+
+
+def parse_text(obj):
+    """ Selects the content-type of a text response data
+    :param obj: (str) response data which is not a file path
+    :return: (tuple) data (bytes), content-type (str)
+    """
+    if is_json(obj):
+        ctype = 'application/json'
+    elif is_html(obj):
+        ctype = 'text/html'
+    elif is_xml(obj):
+        ctype = 'application/xml'
+    else:
+        ctype = 'text/plain'
+    return bytes(obj.encode()), ctype
+
+
+def parse_predicates(predicates, name):
+    """ Validates the predicates of the request headers or the query
+    :param predicates: (dict) regex of the values by names, or None
+    :param name: (str) kind of the predicates used in the error messages
+    :return: (dict) copy of the predicates or None
+    """
+    if predicates is None:
+        return None
+    if not isinstance(predicates, dict):
+        raise TypeError('%s predicates should be dict' % name)
+    for key, value in predicates.items():
+        if not isinstance(key, str):
+            raise TypeError('%s predicate name should be str' % name)
+        if value is not None and not isinstance(value, str):
+            raise TypeError('%s predicate should be str or None' % name)
+    return dict(predicates)
+
+
+def shared_body(data, store=None):
+    """ Returns the Body of the parsed data, the equal one from the store """
+    body = Body._make(data)
+    return body if store is None else store.setdefault(data, body)
+
+
+def parse_bodies(objs, workers=None, store=None):
+    """ Parses a list of response data, each distinct data only once. Dicts
+    are equal by their JSON. Files are read in a pool of threads, other data
+    are parsed in place, since their parsing holds the GIL
+    :param objs: (list) response data, like for parse_response
+    :param workers: (int) number of threads reading files, by default is
+    automatic
+    :param store: (dict) parsed bodies by data and content-type, equal bodies
+    are taken from there, so they share one buffer
+    :return: (list) Body or None for each data
+    """
+    result, files = [], {}
+    parsed = {dict: {}, str: {}, bytes: {}}
+    for index, obj in enumerate(objs):
+        if not obj or isinstance(obj, Body):
+            result.append(obj or None)
+            continue
+        if isinstance(obj, dict):
+            kind = dict
+            try:
+                key = json.dumps(obj)
+            except (TypeError, ValueError) as e:
+                raise type(e)('Route %d: %s' % (index, e))
+        elif isinstance(obj, (str, bytes)):
+            kind, key = str if isinstance(obj, str) else bytes, obj
+        else:
+            raise TypeError(
+                'Route %d: response data should be str, dict or bytes' % index
+            )
+        body = parsed[kind].get(key)
+        if body is None:
+            if kind is dict:
+                data = (bytes(key.encode()), 'application/json')
+            elif kind is bytes:
+                data = (obj, 'application/octet-stream')
+            elif isfile(obj):
+                files.setdefault(obj, []).append(index)
+                result.append(None)
+                continue
             else:
-                ctype = 'text/plain'
-            return bytes(obj.encode()), ctype
+                data = parse_text(obj)
+            body = parsed[kind][key] = shared_body(data, store)
+        result.append(body)
+
+    if workers == 1 or len(files) < 2:
+        read = map(parse_response, files)
     else:
-        raise TypeError('Response data should be str or dict')
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            read = list(executor.map(parse_response, files))
+    for indexes, data in zip(files.values(), read):
+        body = shared_body(data, store)
+        for index in indexes:
+            result[index] = body
+    return result
 
 
 class Route:
 
-    __slots__ = '__method', '__path', '__data', '__headers', '__status'
+    __slots__ = (
+        '__method', '__path', '__data', '__headers', '__status',
+        '__match_headers', '__match_query', '__match_body'
+    )
 
-    def __init__(self, method, path, data=None, headers=None, status=200):
+    def __init__(self, method, path, data=None, headers=None, status=200,
+                 match_headers=None, match_query=None, match_body=None):
         """
         :param method: (str) - access method, can be GET, POST, PUT or DELETE
         :param path: (str) - describing the response address, can be regex
-        :param data: (str, dict) - response data
+        :param data: (str, dict, bytes, Body) - response data
         :param headers: (dict) - HTTP response headers
         :param status: (int) - code of the response status
+        :param match_headers: (dict) - required HTTP request headers
+        :param match_query: (dict) - required query string parameters
+        :param match_body: (str, dict) - required content of request body
         """
         self.__data = None
         self.__headers = {}
@@ -209,7 +330,10 @@ class Route:
             raise TypeError('Path should be str')
 
         if data:
-            self.__data, ctype = parse_response(data)
+            if isinstance(data, Body):
+                self.__data, ctype = data
+            else:
+                self.__data, ctype = parse_response(data)
             self.__headers['Content-type'] = ctype
             self.__headers['Content-length'] = len(self.data)
 
@@ -224,20 +348,54 @@ class Route:
         except (TypeError, ValueError):
             raise TypeError('Status code should be int')
 
+        self.__match_headers = parse_predicates(match_headers, 'Headers')
+        self.__match_query = parse_predicates(match_query, 'Query')
+
+        if match_body is None or isinstance(match_body, (str, dict)):
+            self.__match_body = match_body
+        else:
+            raise TypeError('Body predicate should be str or dict')
+
+    @classmethod
+    def restore(cls, method, path, data, headers, status,
+                match_headers=None, match_query=None, match_body=None):
+        """ Creates a route from already validated values without copying
+        them, so the headers and the data can be shared by several routes
+        """
+        route = cls.__new__(cls)
+        route.__method = method
+        route.__path = path
+        route.__data = data
+        route.__headers = headers
+        route.__status = status
+        route.__match_headers = match_headers
+        route.__match_query = match_query
+        route.__match_body = match_body
+        return route
+
     @staticmethod
-    def cast(route):
+    def unpack(route):
+        """ Unpacks a route given as list or tuple
+        :return: (tuple) method, path, data, headers, status
+        """
         if route and isinstance(route, (list, tuple)):
             try:
                 method, path, *opts = route
-                data = opts[0] if len(opts) > 0 else None
-                headers = opts[1] if len(opts) > 1 else None
-                status = opts[2] if len(opts) > 2 else 200
-                return Route(method, path, data, headers, status)
             except ValueError:
                 raise ValueError('Route should contain method and path')
+            data = opts[0] if len(opts) > 0 else None
+            headers = opts[1] if len(opts) > 1 else None
+            status = opts[2] if len(opts) > 2 else 200
+            return method, path, data, headers, status
         else:
             raise TypeError('Route should be list or tuple')
 
+    @staticmethod
+    def cast(route):
+        if isinstance(route, Route):
+            return route
+        return Route(*Route.unpack(route))
+
     @property
     def method(self):
         return self.__method
@@ -258,5 +416,56 @@ class Route:
     def status(self):
         return self.__status
 
+    @property
+    def match_headers(self):
+        return self.__match_headers
+
+    @property
+    def match_query(self):
+        return self.__match_query
+
+    @property
+    def match_body(self):
+        return self.__match_body
+
     def __str__(self):
         return '<Route[method=%s, path=%s]>' % (self.method, self.path)
+
+
+def parse_routes(routes, workers=None, store=None):
+    """ Creates many routes at once, response data are parsed by parse_bodies
+    :param routes: (iterable) - routes as Route, list, tuple or dict
+    :param workers: (int) - number of threads reading files
+    :param store: (dict) - parsed bodies shared between the calls
+    :return: (list) routes, errors name the number of the invalid route
+    """
+    args, data, index = [], [], 0
+    try:
+        for index, route in enumerate(routes):
+            if isinstance(route, Route):
+                args.append(route)
+                data.append(None)
+            elif isinstance(route, dict):
+                args.append(dict(route))
+                data.append(route.get('data'))
+            else:
+                args.append(Route.unpack(route))
+                data.append(args[-1][2])
+    except (TypeError, ValueError) as e:
+        raise type(e)('Route %d: %s' % (index, e))
+
+    bodies = parse_bodies(data, workers, store)
+
+    result, index = [], 0
+    try:
+        for index, (route, body) in enumerate(zip(args, bodies)):
+            if isinstance(route, tuple):
+                method, path, _, headers, status = route
+                route = Route(method, path, body, headers, status)
+            elif isinstance(route, dict):
+                route['data'] = body
+                route = Route(**route)
+            result.append(route)
+    except (TypeError, ValueError) as e:
+        raise type(e)('Route %d: %s' % (index, e))
+    return result
@@ -0,0 +1,329 @@
+"""
+The servers and the request handler used by the Service. The module is
+imported when the Service starts, so "http.server" and "socketserver" are not
+loaded by a plain "import restub".
+"""
+
+
+import errno
+import os
+import socket
+import stat
+from collections import defaultdict
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import zip_longest
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import monotonic, sleep
+
+# Address of the client connected through a Unix socket or a socketpair
+LOCAL_CLIENT = ('localhost', 0)
+
+
+class Server(HTTPServer):
+
+    reuse_port = False
+    # Connections are checked for HTTP/2 preface or ALPN by the handler
+    http2 = False
+    # SSL context of the secure Service, used for the attached connections
+    context = None
+    # Default backlog of 5 drops connections opened at once by many clients
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Connections passed to the stream scheduler, they stay open
+        self.detached = set()
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1
+            )
+        super().server_bind()
+
+    def attach(self, request):
+        """ Processes the connection which is not accepted by the listening
+        socket, like the end of a socketpair
+        """
+        Thread(
+            target=self.process_request,
+            args=(self.wrap_request(request), LOCAL_CLIENT), daemon=True
+        ).start()
+
+    def wrap_request(self, request):
+        if self.context is None:
+            return request
+        # The handshake is done by the handler, when the client is ready
+        return self.context.wrap_socket(
+            request, server_side=True, do_handshake_on_connect=False
+        )
+
+
+class ThreadingServer(ThreadingMixIn, Server):
+
+    daemon_threads = True
+
+    def attach(self, request):
+        self.process_request(self.wrap_request(request), LOCAL_CLIENT)
+
+
+class Http2Server(ThreadingServer):
+
+    http2 = True
+
+
+class UnixMixIn:
+    """ Binds the server to a Unix socket path or, if the path starts with
+    a null byte, to an abstract socket on Linux
+    """
+
+    address_family = socket.AF_UNIX
+    bound = False
+
+    def server_bind(self):
+        path = self.server_address
+        if not path.startswith('\0'):
+            try:
+                if stat.S_ISSOCK(os.stat(path).st_mode):
+                    self.remove_stale(path)
+            except FileNotFoundError:
+                pass
+        self.socket.bind(path)
+        self.bound = True
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    @staticmethod
+    def remove_stale(path):
+        """ Removes the socket file left by the previous run, but not the
+        one used by a running server
+        """
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, 'Socket is used by other server')
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, LOCAL_CLIENT
+
+    def server_close(self):
+        super().server_close()
+        path = self.server_address
+        if self.bound and not path.startswith('\0'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class UnixServer(UnixMixIn, Server):
+    pass
+
+
+class ThreadingUnixServer(UnixMixIn, ThreadingServer):
+    pass
+
+
+class Http2UnixServer(UnixMixIn, Http2Server):
+    pass
+
+
+# Names should be the same as in restub.stub.ENGINES
+ENGINES = {
+    'sync': Server,
+    'threading': ThreadingServer,
+    'http2': Http2Server,
+}
+
+UNIX_ENGINES = {
+    'sync': UnixServer,
+    'threading': ThreadingUnixServer,
+    'http2': Http2UnixServer,
+}
+
+
+def trace_info(request_line, path, status, request_headers,
+               response_headers, payload=None):
+    """ Formats the trace log of the processed request
+    :param request_line: (str) - method with the protocol prefix if needed
+    :param request_headers: (iterable) - pairs of the request headers
+    :param response_headers: (iterable) - pairs of the response headers
+    :return: (str) message
+    """
+    hres = ['%s: %s' % (k, v) for k, v in response_headers]
+    hreq = ['%s: %s' % (k, v) for k, v in request_headers]
+    padding = max((len(header) for header in hreq), default=0) + 10
+
+    sline, cols, hdrs = '%s "%s", status: %d', '%-*s%s', ''
+    sline = sline % (request_line, path, status)
+    cols = cols % (padding, 'Request headers:', 'Response headers:')
+
+    for req, res in zip_longest(hreq, hres, fillvalue=None):
+        req = '%s %s' % (chr(9899), req) if req else ''
+        res = '%s %s' % (chr(9898), res) if res else ''
+        hdrs += '%-*s %s\n' % (padding - 1, req, res)
+
+    info = {'start_line': sline, 'columns': cols, 'headers': hdrs}
+    if payload:
+        info['payload'] = '%s Payload: %s' % (chr(10503), payload)
+
+    fmt = '{d[start_line]}\n{d[columns]}\n{d[headers]}{d[payload]}'
+    return fmt.format(d=defaultdict(str, **info))
+
+
+def handler_factory(server):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def handle(self):
+            if self.server.http2:
+                from restub.http2 import Connection, is_http2
+                if is_http2(self.connection):
+                    Connection(self, server).serve()
+                    return
+            super().handle()
+
+        def do_GET(self):
+            self.proceed()
+
+        def do_POST(self):
+            self.proceed()
+
+        def do_PUT(self):
+            self.proceed()
+
+        def do_DELETE(self):
+            self.proceed()
+
+        def proceed(self):
+            started = monotonic()
+            self._payload, self._status, self._sent = None, 0, 0
+            profiler = server.profiler
+            self._timing = profiler and profiler.begin(self.command, self.path)
+            try:
+                self.respond()
+            except OSError:
+                pass
+            except Exception as e:
+                server.log('Error %s "%s": %r' % (self.command, self.path, e))
+                if not self._status:
+                    self.send_error(500)
+                self._status = 500
+            finally:
+                elapsed = monotonic() - started
+                server.metrics.record(self._status, self._sent, elapsed)
+                if self.request not in self.server.detached:
+                    self.request.close()
+                if self._timing:
+                    profiler.end(self._timing, self._status)
+
+        def mark(self, phase):
+            if self._timing:
+                server.profiler.mark(self._timing, phase)
+
+        def respond(self):
+            self.mark('before_resolve')
+            if server.streams:
+                stream = server.resolve_stream(
+                    self.command, self.path, self.headers
+                )
+                if stream:
+                    self.open_stream(stream)
+                    return
+
+            route = server.resolve(
+                self.command, self.path, self.headers, self.get_payload
+            )
+            if not route and server.proxy:
+                try:
+                    route = server.forward(
+                        self.command, self.path, self.headers,
+                        self.get_payload()
+                    )
+                except (HTTPException, OSError) as e:
+                    self.send_error(502)
+                    self.end_headers()
+                    server.log('Proxy error %s "%s": %s' % (
+                        self.command, self.path, e
+                    ))
+                    return
+            self.mark('after_resolve')
+            if not route:
+                self.send_error(404)
+                self.end_headers()
+                server.log('Not found %s "%s"' % (self.command, self.path))
+                return
+
+            self.send_response(route.status)
+
+            for header in route.headers:
+                self.send_header(header, route.headers[header])
+            self.end_headers()
+
+            sleep(server.delay)
+
+            self.mark('before_write')
+            if route.data:
+                self.wfile.write(bytes(route.data))
+                self._sent = len(route.data)
+            self.mark('after_write')
+
+            self.print_info(route)
+
+        def send_response(self, code, message=None):
+            self._status = code
+            super().send_response(code, message)
+
+        def open_stream(self, stream):
+            if not stream.handshake(self):
+                server.log('Stream rejected %s "%s"' % (
+                    self.command, self.path
+                ))
+                return
+            self.server.detached.add(self.request)
+            server.stream(self.request, stream)
+            server.log('Stream %s "%s" is opened, status: %d' % (
+                self.command, self.path, self._status
+            ))
+
+        def print_info(self, route):
+            hres = [
+                ('Server', self.version_string()),
+                ('Date', self.date_time_string())
+            ]
+            hres += route.headers.items()
+            server.log(trace_info(
+                'Method %s' % self.command, self.path, route.status,
+                self.headers.items(), hres, self.get_payload()
+            ))
+
+        def get_payload(self):
+            if self._payload is not None:
+                return self._payload
+            if self.command in ['POST', 'PUT', 'DELETE']:
+                content_length = int(self.headers.get('Content-Length', 0))
+                if content_length:
+                    self._payload = self.rfile.read(content_length)
+            return self._payload
+
+        def log_message(self, *args, **kwargs):
+            return
+
+        def version_string(self):
+            return 'Restub Service'
+
+    return Handler
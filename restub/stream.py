@@ -0,0 +1,430 @@
+"""
+A Stream represents the route which keeps the connection open and sends
+messages to the client at the specified interval. The messages can be given
+as a list, a function returning an iterable (called for every connection), an
+iterable shared by all connections, or a path to the file whose lines are the
+messages. Messages can be str, bytes or dict, which is sent as JSON.
+
+There are two kinds of streams:
+
+    * EventStream sends the messages as Server-Sent Events
+
+    * WebSocket accepts the WebSocket handshake and sends the messages as
+    text frames (or binary frames for bytes)
+
+After the handshake, the connection is passed to a Scheduler. The Scheduler
+multiplexes all open streams in one thread: it sends the messages which are
+due, and does not produce new messages for the client which does not read
+them. When the messages are over, the connection is closed, or the messages
+start again if the repeat flag is set.
+
+Examples:
+    srv.sse(r'/events/$', ['first', 'second'], interval=0.5)
+    srv.websocket(r'/ws/$', lambda: ({'tick': i} for i in range(100)))
+    srv.sse(r'/log/$', '/home/user/path/to/log.txt', repeat=True)
+"""
+
+
+import json
+import selectors
+import socket
+import struct
+from base64 import b64encode
+from collections import deque
+from hashlib import sha1
+from heapq import heappop, heappush
+from itertools import count
+from threading import Lock, Thread
+from time import monotonic
+
+from restub.route import Method, parse_predicates
+
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+def ws_frame(opcode, payload=b''):
+    """ Builds the unmasked WebSocket frame sent by the server """
+    size = len(payload)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 0x10000:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + payload
+
+
+def ws_parse(buffer):
+    """ Parses the masked frames sent by the client
+    :param buffer: (bytearray) - received data, parsed frames are removed
+    :return: (list) pairs of opcode (int) and payload (bytes)
+    """
+    frames = []
+    while len(buffer) >= 2:
+        opcode, size = buffer[0] & 0x0F, buffer[1] & 0x7F
+        offset = 2
+        if size == 126:
+            if len(buffer) < 4:
+                break
+            size, offset = struct.unpack('!H', buffer[2:4])[0], 4
+        elif size == 127:
+            if len(buffer) < 10:
+                break
+            size, offset = struct.unpack('!Q', buffer[2:10])[0], 10
+        masked = buffer[1] & 0x80
+        mask = bytes(buffer[offset:offset + 4]) if masked else None
+        offset += 4 if masked else 0
+        if len(buffer) < offset + size:
+            break
+        payload = bytes(buffer[offset:offset + size])
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        frames.append((opcode, payload))
+        del buffer[:offset + size]
+    return frames
+
+
+class Stream:
+
+    method = Method.GET
+    match_body = None
+
+    def __init__(self, path, messages, interval=0, headers=None,
+                 repeat=False, match_headers=None, match_query=None):
+        """
+        :param path: (str) - describing the stream address, can be regex
+        :param messages: (list, callable, iterable, str) - messages or
+        a path to the file with messages
+        :param interval: (int, float) - interval between messages in seconds
+        :param headers: (dict) - HTTP response headers
+        :param repeat: (bool) - start again when the messages are over
+        :param match_headers: (dict) - required HTTP request headers
+        :param match_query: (dict) - required query string parameters
+        """
+        try:
+            if path.strip():
+                self.path = path
+            else:
+                raise ValueError('Path cannot be empty')
+        except AttributeError:
+            raise TypeError('Path should be str')
+
+        iterable = hasattr(messages, '__iter__')
+        if isinstance(messages, (dict, bytes)) or not (
+                iterable or callable(messages)):
+            raise TypeError('Messages should be list, callable or str')
+        self.messages = messages
+
+        try:
+            self.interval = float(interval)
+        except (TypeError, ValueError):
+            raise TypeError('Interval should be int or float')
+        if self.interval < 0:
+            raise ValueError('Interval cannot be negative')
+
+        if headers is not None and not isinstance(headers, dict):
+            raise TypeError('Headers should be dict')
+        self.headers = headers or {}
+        self.repeat = bool(repeat)
+        self.match_headers = parse_predicates(match_headers, 'Headers')
+        self.match_query = parse_predicates(match_query, 'Query')
+
+    def open(self):
+        """ Returns the iterator of messages for a new connection """
+        while True:
+            empty = True
+            for message in self.__iterate():
+                empty = False
+                yield message
+            if not self.repeat or empty:
+                return
+
+    def __iterate(self):
+        if isinstance(self.messages, str):
+            return read_lines(self.messages)
+        elif callable(self.messages):
+            return iter(self.messages())
+        return iter(self.messages)
+
+    @staticmethod
+    def encode(message):
+        if isinstance(message, (dict, list)):
+            return json.dumps(message)
+        return message
+
+    def handshake(self, handler):
+        """ Sends the response headers
+        :return: (bool) True if the stream can be started
+        """
+        raise NotImplementedError
+
+    def frame(self, message):
+        """ Converts the message to bytes sent to the client """
+        raise NotImplementedError
+
+    def closing(self):
+        """ Bytes sent to the client when the messages are over """
+        return b''
+
+    def receive(self, buffer):
+        """ Processes the data sent by the client, the processed data are
+        removed from the buffer
+        :return: (tuple) bytes to reply, True if the stream should be closed
+        """
+        buffer.clear()
+        return b'', False
+
+    def __str__(self):
+        return '<%s[path=%s]>' % (self.__class__.__name__, self.path)
+
+
+class EventStream(Stream):
+
+    def handshake(self, handler):
+        handler.send_response(200)
+        handler.send_header('Content-type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        for header, value in self.headers.items():
+            handler.send_header(header, value)
+        handler.end_headers()
+        return True
+
+    def frame(self, message):
+        message = self.encode(message)
+        if isinstance(message, bytes):
+            message = message.decode()
+        lines = str(message).split('\n')
+        return ''.join('data: %s\n' % line for line in lines).encode() + b'\n'
+
+
+class WebSocket(Stream):
+
+    def handshake(self, handler):
+        key = handler.headers.get('Sec-WebSocket-Key')
+        upgrade = handler.headers.get('Upgrade', '').lower()
+        if upgrade != 'websocket' or not key:
+            handler.send_error(426)
+            handler.end_headers()
+            return False
+
+        digest = sha1((key.strip() + WS_GUID).encode()).digest()
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', b64encode(digest).decode())
+        for header, value in self.headers.items():
+            handler.send_header(header, value)
+        handler.end_headers()
+        return True
+
+    def frame(self, message):
+        message = self.encode(message)
+        if isinstance(message, bytes):
+            return ws_frame(WS_BINARY, message)
+        return ws_frame(WS_TEXT, str(message).encode())
+
+    def closing(self):
+        return ws_frame(WS_CLOSE, struct.pack('!H', 1000))
+
+    def receive(self, buffer):
+        reply, closed = b'', False
+        for opcode, payload in ws_parse(buffer):
+            if opcode == WS_PING:
+                reply += ws_frame(WS_PONG, payload)
+            elif opcode == WS_CLOSE:
+                reply += ws_frame(WS_CLOSE, payload[:2])
+                closed = True
+        return reply, closed
+
+
+class Connection:
+
+    __slots__ = (
+        'sock', 'stream', 'messages', 'due', 'output', 'input', 'closing',
+        'events'
+    )
+
+    def __init__(self, sock, stream):
+        self.sock = sock
+        self.stream = stream
+        self.messages = stream.open()
+        self.due = monotonic()
+        self.output = bytearray()
+        self.input = bytearray()
+        self.closing = False
+        self.events = 0
+
+    def produce(self):
+        """ Adds the next message to the output
+        :return: (bool) False if the source of messages is broken
+        """
+        try:
+            self.output += self.stream.frame(next(self.messages))
+        except StopIteration:
+            self.output += self.stream.closing()
+            self.closing = True
+        except Exception:
+            # Missing file or failed function closes only its connection
+            return False
+        return True
+
+    def flush(self):
+        """ Sends the output as much as the socket accepts
+        :return: (bool) False if the connection is lost
+        """
+        while self.output:
+            try:
+                sent = self.sock.send(self.output)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError as e:
+                # SSL sockets report the full buffer by SSLWantWriteError
+                if e.__class__.__name__.startswith('SSLWant'):
+                    return True
+                return False
+            del self.output[:sent]
+        return True
+
+    def receive(self):
+        """ Reads the data sent by the client
+        :return: (bool) False if the connection is closed by the client
+        """
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError as e:
+            return e.__class__.__name__.startswith('SSLWant')
+        if not data:
+            return False
+        self.input += data
+        reply, closed = self.stream.receive(self.input)
+        self.output += reply
+        if closed:
+            self.closing = True
+        return True
+
+
+class Scheduler:
+    """ Sends the messages of all attached connections in one thread """
+
+    def __init__(self):
+        self.__selector = selectors.DefaultSelector()
+        self.__queue = []
+        self.__counter = count()
+        self.__pending = deque()
+        self.__lock = Lock()
+        self.__closed = False
+        self.__wakeup, self.__notify = socket.socketpair()
+        self.__wakeup.setblocking(False)
+        self.__selector.register(self.__wakeup, selectors.EVENT_READ)
+        self.__thread = Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    @property
+    def connections(self):
+        return len(self.__selector.get_map()) - 1
+
+    def attach(self, sock, stream):
+        """ Passes the connection with the sent response headers """
+        with self.__lock:
+            self.__pending.append(Connection(sock, stream))
+        self.__wake()
+
+    def close(self):
+        self.__closed = True
+        self.__wake()
+        self.__thread.join()
+
+    def run(self):
+        try:
+            while not self.__closed:
+                self.__poll()
+                self.__attach_pending()
+                self.__send_due()
+        finally:
+            for key in list(self.__selector.get_map().values()):
+                key.fileobj.close()
+            self.__selector.close()
+            self.__notify.close()
+
+    def __wake(self):
+        try:
+            self.__notify.send(b'\0')
+        except OSError:
+            pass
+
+    def __poll(self):
+        timeout = None
+        if self.__queue:
+            timeout = max(0, self.__queue[0][0] - monotonic())
+        for key, events in self.__selector.select(timeout):
+            conn = key.data
+            if conn is None:
+                try:
+                    self.__wakeup.recv(4096)
+                except BlockingIOError:
+                    pass
+                continue
+            alive = True
+            if events & selectors.EVENT_READ:
+                alive = conn.receive()
+            if alive and conn.output:
+                alive = conn.flush()
+            self.__update(conn, alive)
+
+    def __attach_pending(self):
+        with self.__lock:
+            pending, self.__pending = self.__pending, deque()
+        for conn in pending:
+            conn.sock.setblocking(False)
+            conn.events = selectors.EVENT_READ
+            self.__selector.register(conn.sock, conn.events, conn)
+            heappush(self.__queue, (conn.due, next(self.__counter), conn))
+
+    def __send_due(self):
+        now = monotonic()
+        due = []
+        while self.__queue and self.__queue[0][0] <= now:
+            due.append(heappop(self.__queue)[2])
+        for conn in due:
+            if conn.sock.fileno() < 0:
+                continue
+            # The client which does not read messages gets no new ones
+            alive = True
+            if not conn.output and not conn.closing:
+                alive = conn.produce()
+            alive = alive and conn.flush()
+            if self.__update(conn, alive) and not conn.closing:
+                conn.due = max(conn.due + conn.stream.interval, now)
+                heappush(self.__queue, (conn.due, next(self.__counter), conn))
+
+    def __update(self, conn, alive):
+        """ Closes the finished connection or updates the awaited events
+        :return: (bool) True if the connection is still open
+        """
+        if conn.sock.fileno() < 0:
+            return False
+        if not alive or conn.closing and not conn.output:
+            self.__selector.unregister(conn.sock)
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.sock.close()
+            return False
+        events = selectors.EVENT_READ
+        if conn.output:
+            events |= selectors.EVENT_WRITE
+        if events != conn.events:
+            conn.events = events
+            self.__selector.modify(conn.sock, events, conn)
+        return True
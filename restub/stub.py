@@ -36,106 +36,28 @@ Service is started can be received through the "host" property.
 
 
 import logging
-import re
-from collections import defaultdict
+import sys
 from errno import EADDRINUSE
 from functools import wraps
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from itertools import zip_longest
-from pathlib import Path
-from ssl import wrap_socket
-from threading import Thread
+from os.path import exists
+from threading import Lock, Thread
 from time import sleep
 from types import FunctionType
 
-from restub.route import Method, Route
+from restub.matcher import Matcher, Request
+from restub.metrics import Metrics
+from restub.route import Method, Route, parse_routes
+from restub.table import RouteTable
 
 
-logging.basicConfig(
-    format='[%(asctime)s.%(msecs)03d] %(message)s \n',
-    datefmt='%H:%M:%S',
-    level=logging.INFO
-)
-
-
-def handler_factory(server):
-
-    class Handler(BaseHTTPRequestHandler):
-
-        def do_GET(self):
-            self.proceed()
-
-        def do_POST(self):
-            self.proceed()
-
-        def do_PUT(self):
-            self.proceed()
-
-        def do_DELETE(self):
-            self.proceed()
-
-        def proceed(self):
-            route = server.resolve(self.command, self.path)
-            if not route:
-                self.send_error(404)
-                self.end_headers()
-                server.log('Not found %s "%s"' % (self.command, self.path))
-                return
-
-            self.send_response(route.status)
-
-            for header in route.headers:
-                self.send_header(header, route.headers[header])
-            self.end_headers()
-
-            sleep(server.delay)
-
-            if route.data:
-                self.wfile.write(bytes(route.data))
-
-            self.print_info(route)
-            self.request.close()
+ENGINES = ('sync', 'threading', 'http2')
 
-        def print_info(self, route):
-            hres = [
-                'Server: %s' % self.version_string(),
-                'Date: %s' % self.date_time_string()
-            ]
-            hres += ['%s: %s' % (k, v) for k, v in route.headers.items()]
-            hreq = ['%s: %s' % (k, v) for k, v in self.headers.items()]
-            padding = max(len(header) for header in hreq) + 10
-            payload = self.get_payload()
+logger = logging.getLogger(__name__)
 
-            sline, cols, hdrs = 'Method %s "%s", status: %d', '%-*s%s', ''
-            sline = sline % (self.command, self.path, route.status)
-            cols = cols % (padding, 'Request headers:', 'Response headers:')
-
-            for req, res in zip_longest(hreq, hres, fillvalue=None):
-                req = '%s %s' % (chr(9899), req) if req else ''
-                res = '%s %s' % (chr(9898), res) if res else ''
-                hdrs += '%-*s %s\n' % (padding - 1, req, res)
-
-            info = {'start_line': sline, 'columns': cols, 'headers': hdrs}
-            if payload:
-                info['payload'] = '%s Payload: %s' % (chr(10503), payload)
-
-            fmt = '{d[start_line]}\n{d[columns]}\n{d[headers]}{d[payload]}'
-            server.log(fmt.format(d=defaultdict(str, **info)))
-
-        def get_payload(self):
-            if self.command in ['POST', 'PUT', 'DELETE']:
-                content_length = int(self.headers.get('Content-Length', 0))
-                if content_length:
-                    return self.rfile.read(content_length)
-            return None
-
-        def log_message(self, *args, **kwargs):
-            return
-
-        def version_string(self):
-            return 'Restub Service'
-
-    return Handler
+# Format of the trace printed when logging is not configured by application
+TRACE_FORMAT = logging.Formatter(
+    '[%(asctime)s.%(msecs)03d] %(message)s \n', '%H:%M:%S'
+)
 
 
 class Service:
@@ -150,17 +72,38 @@ class Service:
             secure (bool) - use ssl, by default is False`
             key (str) - absolute file path to ssl private key
             crt (str) - absolute file path to ssl certificate
+            proxy (str) - upstream address for requests without route
+            cache (str) - directory to record the proxied responses
+            engine (str) - "sync", "threading" or "http2", by default is "sync"
+            reuse_port (bool) - share the port between processes
+            unix (str) - path of the Unix socket used instead of the port,
+            "@name" or "\0name" is the abstract socket on Linux
+            stream_threads (int) - threads sending the streams, by default 1
+            profile (int) - number of the slowest requests to keep
+            profile_threshold (int, float) - duration in seconds after which
+            stacks of the request are sampled, see restub.profiler
         """
         self._server = None
-        self._routes = []
+        self._routes = RouteTable()
+        self._matcher = None
+        self._pool = None
+        self._streams = []
+        self._stream_matcher = None
+        self._schedulers = []
+        self._scheduled = 0
+        self._stream_lock = Lock()
+        self.metrics = Metrics()
+        self.profiler = None
 
         if routes:
+            if isinstance(routes, Route):
+                routes = [routes]
             if not isinstance(routes, (list, tuple)):
                 raise TypeError('Routes should be list or tuple')
-            if all(isinstance(route, (list, tuple)) for route in routes):
-                self._routes = [Route.cast(route) for route in routes]
+            if all(isinstance(r, (list, tuple, Route)) for r in routes):
+                self.add_routes(routes)
             else:
-                self._routes = [Route.cast(routes)]
+                self.add_routes([routes])
 
         self.__set_port(port)
         self.__set_trace(kwargs.get('trace', False))
@@ -168,10 +111,26 @@ class Service:
         self.__set_crt(kwargs.get('crt', ''))
         self.__set_key(kwargs.get('key', ''))
         self.__set_secure(kwargs.get('secure', False))
+        self.__set_proxy(kwargs.get('proxy', None))
+        self.__set_cache(kwargs.get('cache', None))
+        self.__set_engine(kwargs.get('engine', 'sync'))
+        self.__set_reuse_port(kwargs.get('reuse_port', False))
+        self.__set_unix(kwargs.get('unix', None))
+        self.__set_stream_threads(kwargs.get('stream_threads', 1))
+        self.__set_profiler(
+            kwargs.get('profile', 0), kwargs.get('profile_threshold', None)
+        )
 
     def start(self):
-        if self._routes:
+        if self._routes or self.proxy or self._streams:
+            self._matcher = Matcher(self._routes)
+            self._stream_matcher = Matcher(self._streams)
+            if self.proxy:
+                from restub.proxy import Pool
+                self._pool = Pool(self.proxy)
             self._server = self._create(attempts=3)
+            if self.profiler:
+                self.profiler.start()
             self.log('Service:%d is running at %s' % (self.port, self.host))
             Thread(target=self._server.serve_forever, daemon=True).start()
         else:
@@ -180,47 +139,183 @@ class Service:
     def stop(self):
         if self._server:
             self._server.server_close()
+            self._server = None
             self.log('Service:%d was stopped' % self.port)
+        if self._pool:
+            self._pool.close()
+        if self.profiler:
+            self.profiler.stop()
+        for scheduler in self._schedulers:
+            scheduler.close()
+        self._schedulers = []
+
+    def get(self, path, data=None, headers=None, status=200, **match):
+        self.add(Route(Method.GET, path, data, headers, status, **match))
+
+    def post(self, path, data=None, headers=None, status=200, **match):
+        self.add(Route(Method.POST, path, data, headers, status, **match))
+
+    def put(self, path, headers=None, status=200, **match):
+        self.add(Route(Method.PUT, path, None, headers, status, **match))
+
+    def delete(self, path, data=None, headers=None, status=200, **match):
+        self.add(Route(Method.DELETE, path, data, headers, status, **match))
+
+    def sse(self, path, messages, interval=0, headers=None, repeat=False,
+            **match):
+        """ Adds the stream of Server-Sent Events, see restub.stream """
+        from restub.stream import EventStream
+        self.add_stream(EventStream(
+            path, messages, interval, headers, repeat, **match
+        ))
+
+    def websocket(self, path, messages, interval=0, headers=None,
+                  repeat=False, **match):
+        """ Adds the stream of WebSocket messages, see restub.stream """
+        from restub.stream import WebSocket
+        self.add_stream(WebSocket(
+            path, messages, interval, headers, repeat, **match
+        ))
+
+    def add_stream(self, stream):
+        self._streams.append(stream)
+        self._stream_matcher = None
+
+    def resolve_stream(self, method, path, headers=None):
+        """ Finds the first stream suitable for the request """
+        matcher = self._stream_matcher
+        if matcher is None:
+            matcher = self._stream_matcher = Matcher(self._streams)
+        return matcher.resolve(Request(method, path, headers))
+
+    def stream(self, sock, stream):
+        """ Passes the connection to one of the stream schedulers """
+        from restub.stream import Scheduler
+
+        with self._stream_lock:
+            if not self._schedulers:
+                self._schedulers = [
+                    Scheduler() for _ in range(self.stream_threads)
+                ]
+            self._scheduled += 1
+            schedulers = self._schedulers
+        schedulers[self._scheduled % len(schedulers)].attach(sock, stream)
+
+    def hook(self, phase, callback):
+        """ Adds the function called at the phase of every request with the
+        Timing of the request and the phase name, see restub.profiler
+        """
+        if self.profiler is None:
+            from restub.profiler import Profiler
+            self.profiler = Profiler(slowest=0)
+        self.profiler.hook(phase, callback)
+
+    def connect(self):
+        """ Opens the connection to the running Service through a socketpair,
+        without the TCP stack. The connection serves one request, for
+        example, it can be set as "sock" of http.client.HTTPConnection.
+        :return: (socket) client end of the connection
+        """
+        if not self._server:
+            raise ValueError('Service is not running')
+        import socket
+        client, request = socket.socketpair()
+        self._server.attach(request)
+        return client
+
+    def add(self, route):
+        self._routes.append(Route.cast(route))
+        self._matcher = None
+
+    def add_routes(self, routes, workers=None):
+        """ Adds many routes at once. Each distinct response data is parsed
+        only once, files are read in a pool of threads, and the routes index
+        is rebuilt once. If some route is invalid, none of them is added.
+        :param routes: (iterable) - routes as Route, list, tuple or dict
+        :param workers: (int) - number of threads reading files
+        """
+        self._routes.extend(parse_routes(routes, workers))
+        self._matcher = None
+
+    def resolve(self, method, path, headers=None, body=None):
+        """ Finds the first route suitable for the request
+        :param method: (str) - access method
+        :param path: (str) - requested address with the query string
+        :param headers: (dict, Message) - HTTP request headers
+        :param body: (bytes, callable) - request body or function reading it
+        :return: (Route, None) suitable route or None if nothing found
+        """
+        matcher = self._matcher
+        if matcher is None:
+            matcher = self._matcher = Matcher(self._routes)
+        return matcher.resolve(Request(method, path, headers, body))
+
+    def memory_report(self):
+        """ Estimates the memory used by the routes
+        :return: (dict) bytes used by routes, bodies, indexes and in total
+        """
+        matcher = self._matcher
+        if matcher is None:
+            matcher = self._matcher = Matcher(self._routes)
+        report = self._routes.memory()
+        report['indexes'] = matcher.memory()
+        report['total'] = sum(report.values())
+        return report
+
+    def forward(self, method, path, headers=None, body=None):
+        """ Sends the request to the proxy upstream and records the response
+        :return: (Route) route returning the received response
+        """
+        from restub.proxy import make_route, request_headers, response_headers
 
-    def get(self, path, data=None, headers=None, status=200):
-        self._routes.append(Route(Method.GET, path, data, headers, status))
-
-    def post(self, path, data=None, headers=None, status=200):
-        self._routes.append(Route(Method.POST, path, data, headers, status))
-
-    def put(self, path, headers=None, status=200):
-        self._routes.append(Route(Method.PUT, path, None, headers, status))
-
-    def delete(self, path, data=None, headers=None, status=200):
-        self._routes.append(Route(Method.DELETE, path, data, headers, status))
-
-    def resolve(self, method, path):
-        for route in self._routes:
-            if route.method == method and re.match(route.path, path, re.U):
-                return route
-        return None
+        status, headers, data = self._pool.request(
+            method, path, request_headers(headers or {}), body
+        )
+        headers = response_headers(headers)
+        if self.cache:
+            self.cache.store(method, path, status, headers, data)
+        return make_route(method, path, status, headers, data)
 
     def log(self, message):
         if self.trace:
-            logger = logging.getLogger(__name__)
-            logger.info(message)
+            if logger.hasHandlers():
+                logger.info(message)
+                return
+            # Logging is not configured by application, so print trace
+            record = logger.makeRecord(
+                logger.name, logging.INFO, __file__, 0, message, None, None
+            )
+            print(TRACE_FORMAT.format(record), file=sys.stderr, flush=True)
 
     def _create(self, attempts):
+        from restub.server import ENGINES, handler_factory, UNIX_ENGINES
+
+        engines = UNIX_ENGINES if self.unix else ENGINES
         while attempts >= 0:
             # Socket is slowly closed, so need more attempts for fast re-open
+            server = engines[self.engine](
+                self.socket, handler_factory(self), bind_and_activate=False
+            )
+            server.reuse_port = self.reuse_port
             try:
+                server.server_bind()
+                server.server_activate()
                 if self.secure:
-                    server = HTTPServer(self.socket, handler_factory(self))
-                    server.socket = wrap_socket(
-                        server.socket,
-                        keyfile=self.key,
-                        certfile=self.crt,
-                        server_side=True
+                    import ssl
+                    # PROTOCOL_TLS_SERVER is available since Python 3.6
+                    context = ssl.SSLContext(getattr(
+                        ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23
+                    ))
+                    context.load_cert_chain(self.crt, self.key)
+                    if self.engine == 'http2':
+                        context.set_alpn_protocols(['h2', 'http/1.1'])
+                    server.socket = context.wrap_socket(
+                        server.socket, server_side=True
                     )
-                    return server
-                else:
-                    return HTTPServer(self.socket, handler_factory(self))
+                    server.context = context
+                return server
             except OSError as e:
+                server.server_close()
                 if e.errno == EADDRINUSE:
                     sleep(0.5)
                     attempts -= 1
@@ -246,11 +341,17 @@ class Service:
 
     @property
     def socket(self):
+        if self.unix:
+            return self.unix
         return 'localhost', self.port
 
     @property
     def host(self):
         proto = 'https' if self.secure else 'http'
+        if self.unix:
+            # The scheme of Unix sockets understood by requests-unixsocket
+            from urllib.parse import quote
+            return '%s+unix://%s' % (proto, quote(self.unix, safe=''))
         return '%s://%s:%d' % (proto, self.socket[0], self.socket[1])
 
     def __get_port(self):
@@ -271,6 +372,27 @@ class Service:
     def __get_crt(self):
         return self.__crt
 
+    def __get_engine(self):
+        return self.__engine
+
+    def __get_reuse_port(self):
+        return self.__reuse_port
+
+    def __get_unix(self):
+        return self.__unix
+
+    def __get_streams(self):
+        return self._streams
+
+    def __get_stream_threads(self):
+        return self.__stream_threads
+
+    def __get_proxy(self):
+        return self.__proxy
+
+    def __get_cache(self):
+        return self.__cache
+
     def __set_port(self, port):
         try:
             self.__port = int(port)
@@ -295,16 +417,82 @@ class Service:
         self.__secure = secure
 
     def __set_key(self, key):
-        try:
-            self.__key = key if Path(key).exists() else False
-        except TypeError:
+        # Int is a file descriptor for exists, so the type is checked first
+        if not isinstance(key, str):
             raise TypeError('key should be str')
+        self.__key = key if exists(key) else False
 
     def __set_crt(self, crt):
-        try:
-            self.__crt = crt if Path(crt).exists() else False
-        except TypeError:
+        # Int is a file descriptor for exists, so the type is checked first
+        if not isinstance(crt, str):
             raise TypeError('crt should be str')
+        self.__crt = crt if exists(crt) else False
+
+    def __set_proxy(self, proxy):
+        if proxy is not None and not isinstance(proxy, str):
+            raise TypeError('proxy should be str')
+        if proxy and not proxy.startswith(('http://', 'https://')):
+            raise ValueError('proxy should be http or https address')
+        self.__proxy = proxy or None
+
+    def __set_cache(self, cache):
+        if cache is None:
+            self.__cache = None
+            return
+
+        from restub.proxy import Cache
+        if isinstance(cache, Cache):
+            self.__cache = cache
+        elif isinstance(cache, str):
+            self.__cache = Cache(cache)
+        else:
+            raise TypeError('cache should be str')
+
+    def __set_engine(self, engine):
+        if engine not in ENGINES:
+            raise ValueError('Engine "%s" is not supported' % engine)
+        self.__engine = engine
+
+    def __set_stream_threads(self, stream_threads):
+        try:
+            self.__stream_threads = int(stream_threads)
+        except (TypeError, ValueError):
+            raise TypeError('stream_threads should be int')
+        if self.__stream_threads < 1:
+            raise ValueError('stream_threads should be positive')
+
+    def __set_profiler(self, slowest, threshold):
+        if slowest is True:
+            slowest = 10
+        try:
+            slowest = int(slowest or 0)
+        except (TypeError, ValueError):
+            raise TypeError('profile should be int')
+        if slowest < 0:
+            raise ValueError('profile cannot be negative')
+        if threshold is not None:
+            try:
+                threshold = float(threshold)
+            except (TypeError, ValueError):
+                raise TypeError('profile_threshold should be int or float')
+            if threshold < 0:
+                raise ValueError('profile_threshold cannot be negative')
+            slowest = slowest or 10
+        if slowest:
+            from restub.profiler import Profiler
+            self.profiler = Profiler(slowest, threshold)
+
+    def __set_reuse_port(self, reuse_port):
+        self.__reuse_port = bool(reuse_port)
+
+    def __set_unix(self, unix):
+        if unix is not None and not isinstance(unix, str):
+            raise TypeError('unix should be str')
+        if unix and unix[0] in ('@', '\0'):
+            if not sys.platform.startswith('linux'):
+                raise ValueError('Abstract sockets are supported on Linux')
+            unix = '\0' + unix[1:]
+        self.__unix = unix or None
 
     port = property(__get_port, __set_port)
     trace = property(__get_trace, __set_trace)
@@ -312,3 +500,10 @@ class Service:
     secure = property(__get_secure, __set_secure)
     key = property(__get_key, __set_key)
     crt = property(__get_crt, __set_crt)
+    proxy = property(__get_proxy, __set_proxy)
+    cache = property(__get_cache, __set_cache)
+    engine = property(__get_engine, __set_engine)
+    reuse_port = property(__get_reuse_port, __set_reuse_port)
+    unix = property(__get_unix, __set_unix)
+    stream_threads = property(__get_stream_threads, __set_stream_threads)
+    streams = property(__get_streams)
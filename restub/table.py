@@ -0,0 +1,145 @@
+"""
+The RouteTable is a compact storage of routes for very large route tables.
+Instead of keeping a Route object per route, values are stored by columns:
+
+    * methods and status codes are kept in arrays of small integers
+
+    * equal sets of headers are stored once and shared by the routes
+
+    * bodies are stored once per SHA-256 of their content, so equal bodies of
+    different routes share one buffer
+
+    * request predicates are kept only for the routes having them
+
+The table behaves like a read-only list of routes: routes taken by index or
+by iteration are lightweight views restored from the columns, and equal
+views share the headers and the body.
+
+Examples:
+    table = RouteTable(routes)
+    table.append(Route('GET', r'/$'))
+    route = table[0]
+"""
+
+
+from array import array
+from hashlib import sha256
+from sys import getsizeof, intern
+from types import MappingProxyType
+
+from restub.route import Method, Route
+
+
+class RouteTable:
+
+    def __init__(self, routes=None):
+        """
+        :param routes: (iterable) - initial routes
+        """
+        self.__methods = array('B')
+        self.__statuses = array('H')
+        self.__headers = array('I')
+        self.__bodies = array('I')
+        self.__paths = []
+        self.__predicates = {}
+
+        self.__header_sets = []
+        self.__header_ids = {}
+        self.__body_store = [None]
+        self.__body_ids = {}
+
+        if routes:
+            self.extend(routes)
+
+    def append(self, route):
+        self.extend([route])
+
+    def extend(self, routes):
+        """ Adds the routes, none of them if some status is out of range """
+        routes = list(routes)
+        statuses = [route.status for route in routes]
+        if any(not 0 <= status <= 0xFFFF for status in statuses):
+            raise ValueError('Status code should be between 0 and 65535')
+
+        # Columns are filled before the paths, which publish the rows, so
+        # the concurrent reader never sees a partial row
+        start = len(self.__paths)
+        methods, headers, bodies = array('B'), array('I'), array('I')
+        predicates = {}
+        for row, route in enumerate(routes, start):
+            match = (route.match_headers, route.match_query, route.match_body)
+            if match != (None, None, None):
+                predicates[row] = match
+            methods.append(Method.ALLOWED.index(route.method))
+            headers.append(self.__header_set(route.headers))
+            bodies.append(self.__body(route.data))
+
+        self.__methods.extend(methods)
+        self.__statuses.extend(statuses)
+        self.__headers.extend(headers)
+        self.__bodies.extend(bodies)
+        self.__predicates.update(predicates)
+        self.__paths.extend([intern(route.path) for route in routes])
+
+    def memory(self):
+        """ Estimates the memory used by the table
+        :return: (dict) bytes used by routes and bodies
+        """
+        routes = sum(map(getsizeof, (
+            self.__methods, self.__statuses, self.__headers, self.__bodies,
+            self.__paths, self.__predicates, self.__header_sets,
+            self.__header_ids,
+        )))
+        routes += sum(getsizeof(path) for path in set(self.__paths))
+        routes += sum(getsizeof(dict(h)) for h in self.__header_sets)
+        routes += sum(getsizeof(p) for p in self.__predicates.values())
+        routes += sum(getsizeof(key) for key in self.__header_ids)
+        bodies = getsizeof(self.__body_store) + getsizeof(self.__body_ids)
+        bodies += sum(getsizeof(body) for body in self.__body_store[1:])
+        bodies += sum(getsizeof(digest) for digest in self.__body_ids)
+        return {'routes': routes, 'bodies': bodies}
+
+    def __header_set(self, headers):
+        key = tuple(headers.items())
+        try:
+            index = self.__header_ids.get(key)
+        except TypeError:
+            # Unhashable values of headers, so the set is not shared
+            key, index = None, None
+        if index is None:
+            index = len(self.__header_sets)
+            self.__header_sets.append(MappingProxyType(dict(headers)))
+            if key is not None:
+                self.__header_ids[key] = index
+        return index
+
+    def __body(self, data):
+        if data is None:
+            return 0
+        digest = sha256(data).digest()
+        index = self.__body_ids.get(digest)
+        if index is None:
+            index = self.__body_ids[digest] = len(self.__body_store)
+            self.__body_store.append(data)
+        return index
+
+    def __len__(self):
+        return len(self.__paths)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        path = self.__paths[row]
+        match = self.__predicates.get(row, ())
+        return Route.restore(
+            Method.ALLOWED[self.__methods[row]],
+            path,
+            self.__body_store[self.__bodies[row]],
+            self.__header_sets[self.__headers[row]],
+            self.__statuses[row],
+            *match
+        )
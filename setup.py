@@ -21,6 +21,9 @@ setup(
     author_email='i.tolkachnikov@gmail.com',
     url='https://github.com/everhide/restub',
     packages=['restub'],
+    entry_points={
+        'console_scripts': ['restub = restub.cli:main'],
+    },
     include_package_data=True,
     zip_safe=False,
     install_requires=[],
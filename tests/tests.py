@@ -7,16 +7,36 @@ For example, in Linux:
 
 import json
 import logging
+import signal
+import socket
+import ssl
+import struct
+import subprocess
+import sys
 import unittest
 import warnings
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 from shutil import rmtree
-from time import time
+from threading import Thread
+from time import sleep, time
 
 import requests
 
-from restub.route import CTYPES, Method, Route
+from restub.cli import load_routes, parse_args
+from restub.hpack import Decoder, Encoder
+from restub.http2 import (
+    ACK, DATA, END_HEADERS, END_STREAM, GOAWAY, HEADERS, INITIAL_WINDOW_SIZE,
+    PING, PREFACE, SETTINGS, WINDOW_UPDATE, frame
+)
+from restub.matcher import Matcher, Request
+from restub.profiler import PHASES
+from restub.proxy import Cache
+from restub.route import CTYPES, Method, Route, parse_bodies
+from restub.stream import EventStream, ws_frame, ws_parse
 from restub.stub import Service
+from restub.table import RouteTable
 
 
 class ServiceArgsTest(unittest.TestCase):
@@ -59,6 +79,12 @@ class ServiceArgsTest(unittest.TestCase):
                 res = requests.get(srv.host, verify=self.crt)
                 self.assertEqual(res.status_code, 200)
 
+    def test_secure_files_invalid(self):
+        with self.assertRaises(TypeError):
+            Service(routes=[Method.GET, r'/$'], crt=1)
+        with self.assertRaises(TypeError):
+            Service(routes=[Method.GET, r'/$'], key=2)
+
     def test_secure_without_key(self):
         secure_opts = {'secure': True, 'crt': self.crt}
         with self.assertRaises(ValueError):
@@ -74,6 +100,114 @@ class ServiceArgsTest(unittest.TestCase):
             with Service(routes=[Method.GET, r'/$'], trace=True) as srv:
                 requests.get(srv.host)
 
+    def test_trace_without_logging(self):
+        script = '''
+import logging
+from http.client import HTTPConnection
+from restub import Service
+with Service(routes=['GET', r'/$'], trace=True):
+    for _ in range(2):
+        conn = HTTPConnection('localhost', 8081)
+        conn.request('GET', '/')
+        conn.getresponse().read()
+        conn.close()
+        logging.basicConfig(level=logging.INFO, format='app: %(message)s')
+'''
+        root = Path(__file__).parent.parent.absolute().as_posix()
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], cwd=root,
+            stderr=subprocess.STDOUT, universal_newlines=True
+        )
+        self.assertEqual(output.count('Method GET "/"'), 2)
+        self.assertEqual(output.count('app: Method GET "/"'), 1)
+
+    def test_engine_threading(self):
+        with Service(routes=[Method.GET, r'/$'], engine='threading') as srv:
+            res = requests.get(srv.host)
+            self.assertEqual(res.status_code, 200)
+
+    def test_engine_invalid(self):
+        with self.assertRaises(ValueError):
+            Service(routes=[Method.GET, r'/$'], engine='unknown')
+
+    def test_reuse_port(self):
+        opts = {'routes': [Method.GET, r'/$'], 'reuse_port': True}
+        with Service(**opts) as first, Service(**opts) as second:
+            res = requests.get(first.host)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(first.host, second.host)
+
+    def test_metrics(self):
+        with Service(routes=[Method.GET, r'/$', 'Hello']) as srv:
+            requests.get(srv.host)
+            requests.get('%s/unknown_path' % srv.host)
+        info = srv.metrics.as_dict()
+        self.assertEqual(info['requests'], 2)
+        self.assertEqual(info['sent'], len('Hello'))
+        self.assertEqual(info['statuses'], {200: 1, 404: 1})
+
+    @staticmethod
+    def request(sock, path='/'):
+        conn = HTTPConnection('localhost')
+        conn.sock = sock
+        conn.request('GET', path)
+        res = conn.getresponse()
+        return res.status, res.read()
+
+    def test_unix(self):
+        path = Path('temp_restub.sock').absolute().as_posix()
+        with Service(routes=[Method.GET, r'/$'], unix=path) as srv:
+            self.assertEqual(srv.socket, path)
+            self.assertEqual(
+                srv.host, 'http+unix://%s' % path.replace('/', '%2F')
+            )
+            for url, status in (('/', 200), ('/unknown', 404)):
+                sock = socket.socket(socket.AF_UNIX)
+                sock.connect(srv.socket)
+                self.assertEqual(self.request(sock, url)[0], status)
+        self.assertFalse(Path(path).exists())
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Linux only')
+    def test_unix_abstract(self):
+        opts = {'unix': '@restub', 'engine': 'threading'}
+        with Service(routes=[Method.GET, r'/$', 'Hello'], **opts) as srv:
+            self.assertEqual(srv.socket, '\0restub')
+            self.assertEqual(srv.host, 'http+unix://%00restub')
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(srv.socket)
+            self.assertEqual(self.request(sock), (200, b'Hello'))
+
+    def test_unix_busy(self):
+        path = Path('temp_restub.sock').absolute().as_posix()
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(path)
+        stale.close()
+        opts = {'routes': [Method.GET, r'/$'], 'unix': path}
+        with Service(**opts) as srv:
+            with self.assertRaises(OSError):
+                Service(**opts).start()
+            sock = socket.socket(socket.AF_UNIX)
+            sock.connect(srv.socket)
+            self.assertEqual(self.request(sock)[0], 200)
+
+    def test_unix_invalid(self):
+        with self.assertRaises(TypeError):
+            Service(routes=[Method.GET, r'/$'], unix=8081)
+
+    def test_connect(self):
+        with Service(routes=[Method.GET, r'/$', 'Hello']) as srv:
+            self.assertEqual(self.request(srv.connect()), (200, b'Hello'))
+        with self.assertRaises(ValueError):
+            srv.connect()
+
+    def test_connect_secure(self):
+        context = ssl.create_default_context(cafile=self.crt)
+        context.check_hostname = False
+        with Service(routes=[Method.GET, r'/$', 'Hello'], secure=True,
+                     crt=self.crt, key=self.key) as srv:
+            sock = context.wrap_socket(srv.connect())
+            self.assertEqual(self.request(sock), (200, b'Hello'))
+
 
 class ServiceTest(unittest.TestCase):
 
@@ -127,6 +261,65 @@ class ServiceTest(unittest.TestCase):
             res = requests.get('%s/user/777/' % srv.host)
             self.assertEqual(res.status_code, 200)
 
+    def test_add_routes(self):
+        srv = Service()
+        srv.add_routes([
+            (Method.GET, r'/list/$', '[1, 2]'),
+            {'method': Method.POST, 'path': r'/list/$', 'status': 201},
+            Route(Method.DELETE, r'/list/$'),
+        ])
+        srv.start()
+        try:
+            get = requests.get('%s/list/' % srv.host)
+            post = requests.post('%s/list/' % srv.host)
+            delete = requests.delete('%s/list/' % srv.host)
+        finally:
+            srv.stop()
+        self.assertEqual(get.json(), [1, 2])
+        self.assertEqual(get.headers['Content-type'], 'application/json')
+        self.assertEqual(post.status_code, 201)
+        self.assertEqual(delete.status_code, 200)
+
+    def test_add_routes_share_bodies(self):
+        srv = Service()
+        srv.add_routes(
+            (Method.GET, r'/item/%d/$' % i, {'key': 'value'}) for i in range(3)
+        )
+        srv.add_routes([(Method.GET, r'/copy/$', '{"key": "value"}')])
+        first, *others = srv._routes
+        for route in others:
+            self.assertIs(route.data, first.data)
+
+    def test_add_routes_faster(self):
+        routes = [
+            (Method.GET, r'/item/%d/$' % i, {'id': i % 50})
+            for i in range(5000)
+        ]
+
+        def bulk():
+            Service().add_routes(routes)
+
+        def loop():
+            srv = Service()
+            for _, path, data in routes:
+                srv.get(path, data)
+
+        timings = {bulk: [], loop: []}
+        for _ in range(5):
+            for add in (bulk, loop):
+                started = time()
+                add()
+                timings[add].append(time() - started)
+        self.assertLess(min(timings[bulk]), min(timings[loop]))
+
+    def test_add_routes_invalid(self):
+        srv = Service()
+        with self.assertRaisesRegex(ValueError, 'Route 1'):
+            srv.add_routes([(Method.GET, r'/$'), ('UNKNOWN', r'/$')])
+        with self.assertRaisesRegex(TypeError, 'Route 0'):
+            srv.add_routes([(Method.GET, r'/$', 3.14)])
+        self.assertEqual(len(srv._routes), 0)
+
 
 class RouteTest(unittest.TestCase):
 
@@ -223,6 +416,29 @@ class RouteTest(unittest.TestCase):
             if Path(tmp).exists() and Path(tmp).is_dir():
                 rmtree(tmp.as_posix())
 
+    def test_parse_bodies(self):
+        tmp = Path().joinpath('temp_data').absolute()
+        tmp.mkdir(exist_ok=True)
+        files = [tmp.joinpath('body.json'), tmp.joinpath('body.xml')]
+        try:
+            for f in files:
+                f.write_bytes(b'<a/>')
+            paths = [f.as_posix() for f in files]
+            bodies = parse_bodies(
+                [{'id': 1}, {'id': 1}, '<a/>', None] + paths + paths
+            )
+        finally:
+            rmtree(tmp.as_posix())
+        first, copy, text, empty, json_file, xml_file, *read = bodies
+        self.assertIs(first, copy)
+        self.assertEqual(first, (b'{"id": 1}', 'application/json'))
+        self.assertEqual(text, (b'<a/>', 'application/xml'))
+        self.assertIsNone(empty)
+        self.assertEqual(json_file, (b'<a/>', 'application/json'))
+        self.assertEqual(xml_file, (b'<a/>', 'application/xml'))
+        self.assertEqual(read, [json_file, xml_file])
+        self.assertIs(read[0], json_file)
+
     def test_data_ctype_override(self):
         header = {"Content-type": "text/html"}
         route = Route.cast([Method.GET, r'/$', 'test text', header])
@@ -265,6 +481,869 @@ class RouteTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             Route.cast([Method.GET, r'/$', None, None, 'status'])
 
+    def test_cast_route_instance(self):
+        route = Route(Method.GET, r'/$')
+        self.assertIs(Route.cast(route), route)
+
+    def test_match_headers_invalid(self):
+        with self.assertRaises(TypeError):
+            Route(Method.GET, r'/$', match_headers=['Accept'])
+
+    def test_match_query_invalid_value(self):
+        with self.assertRaises(TypeError):
+            Route(Method.GET, r'/$', match_query={'page': 2})
+
+    def test_match_body_invalid(self):
+        with self.assertRaises(TypeError):
+            Route(Method.POST, r'/$', match_body=1)
+
+
+class MatcherTest(unittest.TestCase):
+
+    def resolve(self, routes, *args, **kwargs):
+        return Matcher(routes).resolve(Request(*args, **kwargs))
+
+    def test_order_of_registration(self):
+        first = Route(Method.GET, r'/item/[0-9]+/$')
+        second = Route(Method.GET, r'/item/1/$')
+        self.assertIs(self.resolve([first, second], 'GET', '/item/1/'), first)
+        self.assertIs(self.resolve([second, first], 'GET', '/item/1/'), second)
+
+    def test_method_mismatch(self):
+        route = Route(Method.GET, r'/$')
+        self.assertIsNone(self.resolve([route], 'POST', '/'))
+
+    def test_literal_path(self):
+        route = Route(Method.GET, r'/path/$')
+        self.assertIs(self.resolve([route], 'GET', '/path/'), route)
+        self.assertIsNone(self.resolve([route], 'GET', '/path/?q=1'))
+
+    def test_headers(self):
+        xml = Route(Method.GET, r'/$', match_headers={'Accept': '.*xml'})
+        any_ = Route(Method.GET, r'/$')
+        headers = {'accept': 'application/xml'}
+        self.assertIs(self.resolve([xml, any_], 'GET', '/', headers), xml)
+        self.assertIs(self.resolve([xml, any_], 'GET', '/', {}), any_)
+
+    def test_header_presence(self):
+        route = Route(Method.GET, r'/$', match_headers={'X-Token': None})
+        headers = {'X-Token': ''}
+        self.assertIs(self.resolve([route], 'GET', '/', headers), route)
+        self.assertIsNone(self.resolve([route], 'GET', '/', {}))
+
+    def test_query(self):
+        route = Route(Method.GET, r'/items/$', match_query={'page': '2$'})
+        self.assertIs(self.resolve([route], 'GET', '/items/?page=2'), route)
+        self.assertIsNone(self.resolve([route], 'GET', '/items/?page=3'))
+        self.assertIsNone(self.resolve([route], 'GET', '/items/'))
+
+    def test_body_json(self):
+        route = Route(Method.POST, r'/$', match_body={'user': 'admin'})
+        body = b'{"user": "admin", "password": "secret"}'
+        self.assertIs(self.resolve([route], 'POST', '/', body=body), route)
+        self.assertIsNone(self.resolve([route], 'POST', '/', body=b'[]'))
+        self.assertIsNone(self.resolve([route], 'POST', '/', body=b'admin'))
+
+    def test_body_regex(self):
+        route = Route(Method.POST, r'/$', match_body=r'<user>admin</user>')
+        body = b'<login><user>admin</user></login>'
+        self.assertIs(self.resolve([route], 'POST', '/', body=body), route)
+
+    def test_body_read_lazily(self):
+        calls = []
+
+        def read():
+            calls.append(None)
+            return b'{"user": "admin"}'
+
+        plain = Route(Method.POST, r'/$')
+        json_ = Route(Method.POST, r'/$', match_body={'user': 'admin'})
+        self.assertIs(self.resolve([plain], 'POST', '/', body=read), plain)
+        self.assertEqual(len(calls), 0)
+        self.assertIs(self.resolve([json_], 'POST', '/', body=read), json_)
+        self.assertEqual(len(calls), 1)
+
+    def test_service_predicates(self):
+        with Service(routes=[Method.GET, r'/$', 'any']) as srv:
+            srv.post(r'/$', 'admin', match_body={'user': 'admin'})
+            srv.post(r'/$', 'guest')
+            admin = requests.post(srv.host, json={'user': 'admin'})
+            guest = requests.post(srv.host, json={'user': 'guest'})
+            self.assertEqual(admin.text, 'admin')
+            self.assertEqual(guest.text, 'guest')
+
+
+class RouteTableTest(unittest.TestCase):
+
+    def test_restore_route(self):
+        route = Route(
+            Method.POST, r'/$', 'text', {'X-HEADER': 'VALUE'}, 201,
+            match_query={'id': None}
+        )
+        restored = RouteTable([route])[0]
+        self.assertEqual(restored.method, route.method)
+        self.assertEqual(restored.path, route.path)
+        self.assertEqual(restored.data, route.data)
+        self.assertEqual(dict(restored.headers), route.headers)
+        self.assertEqual(restored.status, route.status)
+        self.assertEqual(restored.match_query, route.match_query)
+
+    def test_shared_headers_and_bodies(self):
+        table = RouteTable(
+            Route(Method.GET, r'/%d/$' % i, {'key': 'value'}, {'X-ID': '1'})
+            for i in range(3)
+        )
+        first, *others = table
+        for route in others:
+            self.assertIs(route.data, first.data)
+            self.assertIs(route.headers, first.headers)
+
+    def test_concurrent_read(self):
+        table, errors = RouteTable(), []
+        routes = [Route(Method.GET, r'/%d/$' % i, 'text') for i in range(5000)]
+
+        def read():
+            size = 0
+            while size < 20000:
+                size = len(table)
+                try:
+                    if size:
+                        table[size - 1]
+                except IndexError as e:
+                    errors.append(e)
+                    return
+
+        reader = Thread(target=read)
+        reader.start()
+        for _ in range(4):
+            table.extend(routes)
+        reader.join()
+        self.assertEqual(errors, [])
+
+    def test_headers_read_only(self):
+        table = RouteTable([Route(Method.GET, r'/$', 'text')])
+        with self.assertRaises(TypeError):
+            table[0].headers['X-HEADER'] = 'VALUE'
+
+    def test_status_out_of_range(self):
+        table = RouteTable()
+        with self.assertRaises(ValueError):
+            table.extend([
+                Route(Method.GET, r'/$'),
+                Route(Method.GET, r'/$', None, None, -1),
+            ])
+        self.assertEqual(len(table), 0)
+
+    def test_memory_report(self):
+        srv = Service()
+        srv.add_routes(
+            (Method.GET, r'/item/%d/$' % i, 'x' * 1000) for i in range(100)
+        )
+        report = srv.memory_report()
+        self.assertEqual(
+            set(report), {'routes', 'bodies', 'indexes', 'total'}
+        )
+        self.assertGreater(report['bodies'], 1000)
+        self.assertLess(report['bodies'], 2000)
+        self.assertEqual(
+            report['total'],
+            report['routes'] + report['bodies'] + report['indexes']
+        )
+
+
+class StreamTest(unittest.TestCase):
+
+    WS_HEADERS = (
+        'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+        'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+        'Sec-WebSocket-Version: 13\r\n'
+    )
+
+    @staticmethod
+    def connect(path, headers=''):
+        sock = socket.create_connection(('localhost', 8081), timeout=10)
+        request = 'GET %s HTTP/1.1\r\nHost: localhost\r\n%s\r\n'
+        sock.sendall((request % (path, headers)).encode())
+        return sock
+
+    @staticmethod
+    def read_all(sock):
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                sock.close()
+                return data
+            data += chunk
+
+    def test_messages_invalid(self):
+        with self.assertRaises(TypeError):
+            EventStream(r'/$', 3.14)
+
+    def test_predicates_invalid(self):
+        srv = Service()
+        with self.assertRaises(TypeError):
+            srv.sse(r'/e/$', ['a'], match_headers=['Accept'])
+        with self.assertRaises(TypeError):
+            srv.websocket(r'/ws/$', ['a'], match_query={'page': 2})
+        self.assertEqual(srv._streams, [])
+
+    def test_interval_invalid(self):
+        with self.assertRaises(ValueError):
+            EventStream(r'/$', [], interval=-1)
+
+    def test_sse(self):
+        srv = Service()
+        srv.sse(r'/events/$', ['first', {'key': 'value'}], interval=0.2)
+        with srv:
+            time_start = time()
+            res = requests.get('%s/events/' % srv.host, stream=True)
+            lines = [line for line in res.iter_lines() if line]
+            time_end = time()
+        self.assertEqual(res.headers['Content-type'], 'text/event-stream')
+        self.assertEqual(lines, [b'data: first', b'data: {"key": "value"}'])
+        self.assertGreaterEqual(time_end - time_start, 0.2)
+
+    def test_sse_with_routes(self):
+        srv = Service(routes=[Method.GET, r'/$', 'Hello'])
+        srv.sse(r'/events/$', lambda: (str(i) for i in range(3)))
+        with srv:
+            plain = requests.get(srv.host)
+            first = requests.get('%s/events/' % srv.host).text
+            second = requests.get('%s/events/' % srv.host).text
+        self.assertEqual(plain.text, 'Hello')
+        self.assertEqual(first, 'data: 0\n\ndata: 1\n\ndata: 2\n\n')
+        self.assertEqual(first, second)
+
+    def test_sse_from_file(self):
+        path = Path().joinpath('temp_events.txt').absolute()
+        path.write_text('first\nsecond\n')
+        srv = Service()
+        srv.sse(r'/events/$', path.as_posix())
+        try:
+            with srv:
+                res = requests.get('%s/events/' % srv.host)
+        finally:
+            path.unlink()
+        self.assertEqual(res.text, 'data: first\n\ndata: second\n\n')
+
+    def test_sse_broken_source(self):
+        def broken():
+            yield 'first'
+            raise RuntimeError('Broken source')
+
+        srv = Service()
+        srv.sse(r'/missing/$', 'temp_missing_events.txt')
+        srv.sse(r'/broken/$', broken)
+        srv.sse(r'/good/$', ['good'], interval=0.1)
+        with srv:
+            missing = self.read_all(self.connect('/missing/'))
+            broken = self.read_all(self.connect('/broken/'))
+            good = self.read_all(self.connect('/good/'))
+        self.assertNotIn(b'data: ', missing)
+        self.assertIn(b'data: first', broken)
+        self.assertIn(b'data: good', good)
+
+    def test_sse_input_discarded(self):
+        stream, buffer = EventStream(r'/$', []), bytearray(b'data')
+        self.assertEqual(stream.receive(buffer), (b'', False))
+        self.assertEqual(buffer, b'')
+
+    def test_many_streams(self):
+        srv = Service(stream_threads=2)
+        srv.sse(r'/events/$', ['a', 'b', 'c'], interval=0.1)
+        with srv:
+            time_start = time()
+            socks = [self.connect('/events/') for _ in range(200)]
+            bodies = [self.read_all(sock) for sock in socks]
+            time_end = time()
+        for body in bodies:
+            self.assertEqual(body.count(b'data: '), 3)
+        self.assertLess(time_end - time_start, 5)
+
+    def test_websocket(self):
+        srv = Service()
+        srv.websocket(r'/ws/$', ['text', b'binary'])
+        with srv:
+            data = self.read_all(self.connect('/ws/', self.WS_HEADERS))
+        head, _, frames = data.partition(b'\r\n\r\n')
+        self.assertIn(b' 101 ', head.split(b'\r\n')[0])
+        self.assertIn(b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=', head)
+        self.assertEqual(ws_parse(bytearray(frames)), [
+            (0x1, b'text'), (0x2, b'binary'), (0x8, b'\x03\xe8')
+        ])
+
+    def test_websocket_close_by_client(self):
+        srv = Service()
+        srv.websocket(r'/ws/$', ['tick'], interval=0.1, repeat=True)
+        with srv:
+            sock = self.connect('/ws/', self.WS_HEADERS)
+            sock.recv(4096)
+            # Frames sent by the client are masked: ping, then close
+            mask = b'\x00\x00\x00\x00'
+            sock.sendall(b'\x89\x80' + mask + b'\x88\x80' + mask)
+            frames = ws_parse(bytearray(self.read_all(sock)))
+        self.assertIn((0xA, b''), frames)
+        self.assertEqual(frames[-1], (0x8, b''))
+
+    def test_websocket_without_upgrade(self):
+        srv = Service()
+        srv.websocket(r'/ws/$', ['text'])
+        with srv:
+            res = requests.get('%s/ws/' % srv.host)
+        self.assertEqual(res.status_code, 426)
+
+    def test_ws_frame_length(self):
+        for size in (10, 300, 70000):
+            frame = ws_frame(0x2, b'x' * size)
+            self.assertEqual(ws_parse(bytearray(frame)), [(0x2, b'x' * size)])
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_hooks(self):
+        calls = []
+        srv = Service(routes=[Method.GET, r'/$', 'Hello'])
+        for phase in PHASES:
+            srv.hook(phase, lambda timing, phase: calls.append(
+                (phase, timing.marks[phase])
+            ))
+        with srv:
+            requests.get(srv.host)
+        self.assertEqual([phase for phase, _ in calls], list(PHASES))
+        marks = [mark for _, mark in calls]
+        self.assertEqual(marks, sorted(marks))
+
+    def test_hook_invalid(self):
+        srv = Service(routes=[Method.GET, r'/$'])
+        with self.assertRaises(ValueError):
+            srv.hook('unknown', print)
+        with self.assertRaises(TypeError):
+            srv.hook('after_write', None)
+
+    def test_hook_error(self):
+        def fail(timing, phase):
+            if timing.path == '/fail/':
+                raise RuntimeError('hook failed')
+
+        srv = Service(routes=[Method.GET, r'/\w+/$', 'Hello'], profile=2)
+        srv.hook('after_resolve', fail)
+        with srv:
+            failed = requests.get('%s/fail/' % srv.host)
+            res = requests.get('%s/ok/' % srv.host)
+        self.assertEqual(failed.status_code, 500)
+        self.assertEqual(res.text, 'Hello')
+        self.assertEqual(srv.metrics.as_dict()['statuses'], {200: 1, 500: 1})
+        self.assertEqual(
+            sorted(timing.status for timing in srv.profiler.requests()),
+            [200, 500]
+        )
+
+    def test_slowest(self):
+        srv = Service(routes=[Method.GET, r'/\w+/$', 'Hello'], profile=2)
+        srv.hook('after_resolve', lambda timing, phase: (
+            timing.path == '/slow/' and sleep(0.1)
+        ))
+        with srv:
+            for path in ('fast', 'slow', 'fast', 'fast'):
+                requests.get('%s/%s/' % (srv.host, path))
+        timings = srv.profiler.requests()
+        self.assertEqual(len(timings), 2)
+        self.assertEqual(timings[0].path, '/slow/')
+        self.assertEqual(timings[0].status, 200)
+        self.assertGreaterEqual(timings[0].elapsed, timings[1].elapsed)
+        self.assertEqual(
+            list(timings[1].phases()),
+            ['resolve', 'respond', 'write', 'finish']
+        )
+
+    def test_sampling(self):
+        opts = {'delay': 0.2, 'profile_threshold': 0.05}
+        with Service(routes=[Method.GET, r'/$'], **opts) as srv:
+            requests.get(srv.host)
+            requests.get('%s/unknown_path' % srv.host)
+        timing = srv.profiler.requests()[0]
+        self.assertGreaterEqual(timing.phases()['respond'], 0.2)
+        self.assertTrue(timing.samples)
+        self.assertTrue(any(
+            'respond' in frame for stack in timing.samples for frame in stack
+        ))
+        dump = srv.profiler.dump(limit=1)
+        self.assertIn('1. GET "/" 200', dump)
+        self.assertIn('respond: ', dump)
+        self.assertIn('Samples: ', dump)
+        self.assertNotIn('2. ', dump)
+
+    def test_profile_invalid(self):
+        with self.assertRaises(TypeError):
+            Service(routes=[Method.GET, r'/$'], profile='many')
+        with self.assertRaises(ValueError):
+            Service(routes=[Method.GET, r'/$'], profile_threshold=-1)
+
+
+class HpackTest(unittest.TestCase):
+
+    def test_decode(self):
+        # Requests with Huffman coding from RFC 7541, C.4
+        decoder = Decoder()
+        first = decoder.decode(bytes.fromhex(
+            '828684418cf1e3c2e5f23a6ba0ab90f4ff'
+        ))
+        second = decoder.decode(bytes.fromhex('828684be5886a8eb10649cbf'))
+        self.assertEqual(first[-1], (':authority', 'www.example.com'))
+        self.assertEqual(second[-2:], [
+            (':authority', 'www.example.com'), ('cache-control', 'no-cache')
+        ])
+        self.assertEqual(decoder.table.size, 110)
+
+    def test_decode_invalid(self):
+        with self.assertRaises(ValueError):
+            Decoder().decode(b'\xff\x00')
+
+    def test_encode(self):
+        encoder, decoder = Encoder(), Decoder()
+        headers = [(':status', '200'), ('x-user', 'admin'), ('date', 'now')]
+        first, second = encoder.encode(headers), encoder.encode(headers)
+        self.assertEqual(decoder.decode(first), headers)
+        self.assertEqual(decoder.decode(second), headers)
+        self.assertLess(len(second), len(first))
+
+    def test_encode_invalid(self):
+        encoder = Encoder()
+        with self.assertRaises(UnicodeEncodeError):
+            encoder.encode([('x-user', 'admin'), ('x-name', '\u2603')])
+        self.assertEqual(len(encoder.table.entries), 0)
+
+
+class Http2Test(unittest.TestCase):
+
+    ROUTES = [
+        [Method.GET, r'/$', 'Hello'],
+        [Method.GET, r'/big/$', 'x' * 100000],
+        [Method.POST, r'/user/$', {'id': 1}, None, 201],
+    ]
+
+    @staticmethod
+    def connect():
+        sock = socket.create_connection(('localhost', 8081), timeout=10)
+        sock.sendall(PREFACE + frame(SETTINGS, 0, 0))
+        return sock
+
+    @staticmethod
+    def send(sock, encoder, stream_id, method, path, body=None):
+        block = encoder.encode([
+            (':method', method), (':scheme', 'http'), (':path', path),
+            (':authority', 'localhost:8081'),
+        ])
+        flags = END_HEADERS | (0 if body else END_STREAM)
+        sock.sendall(frame(HEADERS, flags, stream_id, block))
+        if body:
+            sock.sendall(frame(DATA, END_STREAM, stream_id, body))
+
+    @staticmethod
+    def receive(sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Connection is closed')
+            data += chunk
+        return data
+
+    def read_frame(self, sock):
+        header = self.receive(sock, 9)
+        payload = self.receive(sock, int.from_bytes(header[:3], 'big'))
+        stream_id = int.from_bytes(header[5:9], 'big')
+        return header[3], header[4], stream_id, payload
+
+    def read_responses(self, sock, count, update=True):
+        decoder, responses = Decoder(), {}
+        while count:
+            kind, flags, stream_id, payload = self.read_frame(sock)
+            if kind == HEADERS:
+                headers = dict(decoder.decode(payload))
+                responses[stream_id] = [int(headers[':status']), b'']
+            elif kind == DATA:
+                responses[stream_id][1] += payload
+                if update and payload:
+                    size = len(payload).to_bytes(4, 'big')
+                    sock.sendall(frame(WINDOW_UPDATE, 0, 0, size))
+                    sock.sendall(frame(WINDOW_UPDATE, 0, stream_id, size))
+            if kind in (HEADERS, DATA) and flags & END_STREAM:
+                count -= 1
+        return responses
+
+    def test_prior_knowledge(self):
+        with Service(routes=self.ROUTES, engine='http2') as srv:
+            sock, encoder = self.connect(), Encoder()
+            self.send(sock, encoder, 1, 'GET', '/')
+            self.send(sock, encoder, 3, 'GET', '/unknown')
+            self.send(sock, encoder, 5, 'POST', '/user/', b'{}')
+            responses = self.read_responses(sock, 3)
+            sock.close()
+        self.assertEqual(responses[1], [200, b'Hello'])
+        self.assertEqual(responses[3], [404, b''])
+        self.assertEqual(responses[5], [201, b'{"id": 1}'])
+        self.assertEqual(srv.metrics.as_dict()['statuses'], {200: 1, 201: 1,
+                                                             404: 1})
+
+    def test_http1(self):
+        with Service(routes=self.ROUTES, engine='http2') as srv:
+            res = requests.get(srv.host)
+        self.assertEqual(res.text, 'Hello')
+
+    def test_concurrent_streams(self):
+        with Service(routes=self.ROUTES, engine='http2', delay=0.3):
+            sock, encoder = self.connect(), Encoder()
+            started = time()
+            for stream_id in range(1, 20, 2):
+                self.send(sock, encoder, stream_id, 'GET', '/')
+            responses = self.read_responses(sock, 10)
+            elapsed = time() - started
+            sock.close()
+        self.assertEqual(len(responses), 10)
+        self.assertLess(elapsed, 1.0)
+
+    def test_flow_control(self):
+        with Service(routes=self.ROUTES, engine='http2'):
+            sock, encoder = self.connect(), Encoder()
+            self.send(sock, encoder, 1, 'GET', '/big/')
+            received = 0
+            sock.settimeout(0.5)
+            with self.assertRaises(socket.timeout):
+                while True:
+                    kind, _, _, payload = self.read_frame(sock)
+                    received += len(payload) if kind == DATA else 0
+            self.assertEqual(received, 65535)
+            sock.settimeout(10)
+            size = (100000 - received).to_bytes(4, 'big')
+            sock.sendall(frame(WINDOW_UPDATE, 0, 0, size))
+            sock.sendall(frame(WINDOW_UPDATE, 0, 1, size))
+            while received < 100000:
+                kind, _, _, payload = self.read_frame(sock)
+                received += len(payload) if kind == DATA else 0
+            sock.close()
+
+    def test_goaway(self):
+        with Service(routes=self.ROUTES, engine='http2') as srv:
+            sock = socket.create_connection(('localhost', 8081), timeout=10)
+            window = struct.pack('!HI', INITIAL_WINDOW_SIZE, 100)
+            sock.sendall(PREFACE + frame(SETTINGS, 0, 0, window))
+            self.send(sock, Encoder(), 1, 'GET', '/big/')
+            # The response waits for the window update which never comes
+            while self.read_frame(sock)[0] != DATA:
+                pass
+            sock.sendall(frame(GOAWAY, 0, 0, struct.pack('!II', 0, 0)))
+            sock.close()
+            for _ in range(50):
+                if srv.metrics.requests:
+                    break
+                sleep(0.1)
+        self.assertEqual(srv.metrics.requests, 1)
+
+    def test_internal_error(self):
+        routes = self.ROUTES + [
+            [Method.GET, r'/bad/$', 'x', {'X-A': '\u2603'}]
+        ]
+        with Service(routes=routes, engine='http2'):
+            sock, encoder = self.connect(), Encoder()
+            self.send(sock, encoder, 1, 'GET', '/bad/')
+            self.send(sock, encoder, 3, 'GET', '/')
+            responses = self.read_responses(sock, 2)
+            sock.close()
+        self.assertEqual(responses[1], [500, b''])
+        self.assertEqual(responses[3], [200, b'Hello'])
+
+    def test_proxy_invalid_upstream(self):
+        upstream, _ = ProxyTest.broken_upstream(b'NOT HTTP AT ALL\r\n')
+        try:
+            with Service(engine='http2', proxy='http://localhost:8093'):
+                sock = self.connect()
+                self.send(sock, Encoder(), 1, 'GET', '/user/')
+                responses = self.read_responses(sock, 1)
+                sock.close()
+        finally:
+            upstream.shutdown()
+            upstream.server_close()
+        self.assertEqual(responses[1], [502, b''])
+
+    def test_ping(self):
+        with Service(routes=self.ROUTES, engine='http2'):
+            sock = self.connect()
+            sock.sendall(frame(PING, 0, 0, b'restub!!'))
+            while True:
+                kind, flags, _, payload = self.read_frame(sock)
+                if kind == PING:
+                    break
+            sock.close()
+        self.assertEqual((flags, payload), (ACK, b'restub!!'))
+
+    def test_alpn(self):
+        tests_path = Path(__file__).parent.absolute()
+        crt = tests_path.joinpath('restub.crt').as_posix()
+        key = tests_path.joinpath('restub.key').as_posix()
+        context = ssl.create_default_context(cafile=crt)
+        context.check_hostname = False
+        context.set_alpn_protocols(['h2'])
+        with Service(routes=self.ROUTES, engine='http2', secure=True,
+                     crt=crt, key=key):
+            sock = context.wrap_socket(
+                socket.create_connection(('localhost', 8081), timeout=10)
+            )
+            self.assertEqual(sock.selected_alpn_protocol(), 'h2')
+            sock.sendall(PREFACE + frame(SETTINGS, 0, 0))
+            self.send(sock, Encoder(), 1, 'GET', '/')
+            responses = self.read_responses(sock, 1)
+            sock.close()
+        self.assertEqual(responses[1], [200, b'Hello'])
+
+
+class ProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Path().joinpath('temp_cache').absolute()
+        png = CTYPES['.png']
+        self.upstream = Service(port=8091, routes=[
+            (Method.GET, r'/user/', {'name': 'John Doe'}, {'X-ID': '1'}),
+            (Method.POST, r'/user/$', None, None, 201),
+            (Method.GET, r'/logo.png$', b'\x89PNG', {'Content-type': png}),
+        ])
+        self.upstream.start()
+
+    def tearDown(self):
+        self.upstream.stop()
+        if self.cache.exists():
+            rmtree(self.cache.as_posix())
+
+    def test_proxy_invalid(self):
+        with self.assertRaises(ValueError):
+            Service(proxy='localhost:8091')
+
+    def test_forward(self):
+        proxy_opts = {'proxy': self.upstream.host, 'port': 8092}
+        with Service(routes=[Method.GET, r'/$', 'local'], **proxy_opts) as srv:
+            local = requests.get(srv.host)
+            user = requests.get('%s/user/' % srv.host)
+            missed = requests.get('%s/unknown/' % srv.host)
+        self.assertEqual(local.text, 'local')
+        self.assertEqual(user.json(), {'name': 'John Doe'})
+        self.assertEqual(user.headers['X-ID'], '1')
+        self.assertEqual(missed.status_code, 404)
+        self.assertFalse(self.cache.exists())
+
+    def test_upstream_unavailable(self):
+        with Service(proxy='http://localhost:8093', port=8092) as srv:
+            res = requests.get('%s/user/' % srv.host)
+            self.assertEqual(res.status_code, 502)
+
+    @staticmethod
+    def broken_upstream(answer):
+        """ Starts the upstream which answers every request with "answer"
+        or drops the second request of the connection if "answer" is None
+        """
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            received = []
+
+            def handle_one_request(self):
+                self.handled = getattr(self, 'handled', 0) + 1
+                super().handle_one_request()
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.respond()
+
+            def respond(self):
+                self.received.append(self.command)
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if answer is not None:
+                    self.wfile.write(answer)
+                    self.close_connection = True
+                elif self.handled > 1:
+                    self.close_connection = True
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+
+            def log_message(self, *args, **kwargs):
+                return
+
+        upstream = HTTPServer(('localhost', 8093), Handler)
+        Thread(target=upstream.serve_forever, daemon=True).start()
+        return upstream, Handler.received
+
+    def test_upstream_invalid(self):
+        upstream, _ = self.broken_upstream(b'NOT HTTP AT ALL\r\n')
+        try:
+            with Service(proxy='http://localhost:8093', port=8092) as srv:
+                res = requests.get('%s/user/' % srv.host)
+        finally:
+            upstream.shutdown()
+            upstream.server_close()
+        self.assertEqual(res.status_code, 502)
+        self.assertEqual(srv.metrics.as_dict()['statuses'], {502: 1})
+
+    def test_upstream_post_not_repeated(self):
+        upstream, received = self.broken_upstream(None)
+        try:
+            with Service(proxy='http://localhost:8093', port=8092) as srv:
+                first = requests.get('%s/user/' % srv.host)
+                post = requests.post('%s/user/' % srv.host, data=b'{}')
+                get = requests.get('%s/user/' % srv.host)
+        finally:
+            upstream.shutdown()
+            upstream.server_close()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(post.status_code, 502)
+        self.assertEqual(get.status_code, 200)
+        self.assertEqual(received, ['GET', 'POST', 'GET'])
+
+    def test_record_and_replay(self):
+        proxy_opts = {
+            'proxy': self.upstream.host, 'cache': self.cache.as_posix()
+        }
+        with Service(port=8092, **proxy_opts) as srv:
+            requests.get('%s/user/?id=1' % srv.host)
+            requests.post('%s/user/' % srv.host, json={'name': 'James Bond'})
+            requests.get('%s/logo.png' % srv.host)
+            requests.get('%s/logo.png' % srv.host)
+        self.upstream.stop()
+
+        routes = Cache(self.cache.as_posix()).routes()
+        self.assertEqual(len(routes), 3)
+        with Service(routes=routes, port=8092) as srv:
+            user = requests.get('%s/user/?id=1' % srv.host)
+            created = requests.post('%s/user/' % srv.host)
+            logo = requests.get('%s/logo.png' % srv.host)
+            other = requests.get('%s/user/?id=2' % srv.host)
+        self.assertEqual(user.json(), {'name': 'John Doe'})
+        self.assertEqual(user.headers['Content-type'], 'application/json')
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(logo.content, b'\x89PNG')
+        self.assertEqual(logo.headers['Content-type'], 'image/png')
+        self.assertEqual(other.status_code, 404)
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = Path().joinpath('temp_routes.json').absolute()
+        with self.path.open('w') as f:
+            json.dump([
+                [Method.GET, r'/$', 'Hello'],
+                {'method': Method.POST, 'path': r'/$', 'status': 201},
+            ], f)
+
+    def tearDown(self):
+        self.path.unlink()
+
+    def test_load_routes(self):
+        get, post = load_routes(self.path.as_posix())
+        self.assertEqual(get.data, b'Hello')
+        self.assertEqual(post.status, 201)
+
+    def test_load_routes_invalid(self):
+        with self.path.open('w') as f:
+            json.dump([[Method.GET, r'/$'], ['BAD', r'/$']], f)
+        with self.assertRaisesRegex(ValueError, 'Route 1'):
+            load_routes(self.path.as_posix())
+
+    def test_args_without_routes(self):
+        with self.assertRaises(SystemExit):
+            parse_args([])
+
+    def test_args_invalid_workers(self):
+        with self.assertRaises(SystemExit):
+            parse_args([self.path.as_posix(), '--workers', '0'])
+        with self.assertRaises(SystemExit):
+            parse_args([
+                self.path.as_posix(), '--workers', '2', '--unix', 'restub.sock'
+            ])
+
+    def test_run(self):
+        args = [self.path.as_posix(), '--port', '8094', '--workers', '2']
+        args += ['--profile', '3']
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'restub'] + args,
+            stdout=subprocess.PIPE, universal_newlines=True
+        )
+        try:
+            for _ in range(2):
+                self.assertIn('is running at', proc.stdout.readline())
+            get = requests.get('http://localhost:8094/')
+            post = requests.post('http://localhost:8094/')
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            output = proc.communicate(timeout=10)[0]
+        self.assertEqual(get.text, 'Hello')
+        self.assertEqual(post.status_code, 201)
+        self.assertEqual(proc.returncode, 0)
+        self.assertIn('Requests: 2', output)
+        self.assertEqual(output.count('Slowest requests:'), 2)
+
+    def test_worker_error(self):
+        with self.path.open('w') as f:
+            json.dump([['BAD', r'/$', 'Hello']], f)
+        args = [self.path.as_posix(), '--port', '8094', '--workers', '2']
+        proc = subprocess.run(
+            [sys.executable, '-m', 'restub'] + args, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, timeout=10
+        )
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(proc.stderr.count('Route 0: Method "BAD"'), 2)
+
+    def test_terminate_on_start(self):
+        args = [self.path.as_posix(), '--port', '8094', '--workers', '4']
+        for delay in (0.05, 0.1, 0.2, 0.3):
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'restub'] + args,
+                stdout=subprocess.DEVNULL
+            )
+            sleep(delay)
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                raise
+
+
+class ImportTest(unittest.TestCase):
+
+    HEAVY = ['ssl', 'http.server', 'http.client', 'xml.dom.minidom']
+
+    script = '''
+import json, logging, sys, time
+started = time.perf_counter()
+import restub.stub
+from restub import Service
+print(json.dumps({
+    'elapsed': time.perf_counter() - started,
+    'modules': [m for m in %r if m in sys.modules],
+    'handlers': len(logging.getLogger().handlers),
+}))
+'''
+
+    def run_import(self):
+        root = Path(__file__).parent.parent.absolute().as_posix()
+        output = subprocess.check_output(
+            [sys.executable, '-S', '-c', self.script % self.HEAVY], cwd=root
+        )
+        return json.loads(output.decode())
+
+    def test_heavy_modules_are_lazy(self):
+        self.assertEqual(self.run_import()['modules'], [])
+
+    def test_logging_is_not_configured(self):
+        self.assertEqual(self.run_import()['handlers'], 0)
+
+    def test_import_time(self):
+        elapsed = min(self.run_import()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, 0.25)
+
 
 if __name__ == '__main__':
     unittest.main()